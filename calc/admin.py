@@ -0,0 +1,58 @@
+import hmac
+
+import flask
+
+from common import cache, settings
+from .utils import evict_dataset, get_arg_hash_stats, get_dataset_cache_stats
+
+
+def _check_token():
+    auth = flask.request.headers.get('Authorization', '')
+    token = auth[len('Bearer '):] if auth.startswith('Bearer ') else ''
+    if not hmac.compare_digest(token.encode('utf8'), settings.ADMIN_TOKEN.encode('utf8')):
+        flask.abort(403)
+
+
+def cache_stats():
+    """List the cached values by calcfunc and the memory used by the datasets.
+
+    The values are listed from the shared cache, but the lookup counts, the
+    pinned values and the datasets are those of the worker process serving
+    the request.
+    """
+    _check_token()
+    return flask.jsonify(dict(
+        functions=cache.get_group_stats(),
+        tiers=cache.get_stats(),
+        datasets=get_dataset_cache_stats(),
+        argument_hashing=get_arg_hash_stats(),
+    ))
+
+
+def evict():
+    """Evict the cached values of a calcfunc or the loaded variants of a dataset.
+
+    The calcfunc is given as the `function` parameter by its full name (e.g.
+    `calc.emissions.predict_emissions`) and the dataset as the `dataset`
+    parameter by its path. The dataset is evicted from the other worker
+    processes within a few seconds, but the returned count of the variants
+    is that of the worker process serving the request. With the in-process
+    cache backend, the dataset is evicted only from this worker process.
+    """
+    _check_token()
+    func_name = flask.request.values.get('function')
+    dataset = flask.request.values.get('dataset')
+    if not func_name and not dataset:
+        flask.abort(400)
+
+    ret = {}
+    if func_name:
+        ret['values'] = cache.delete_group(func_name)
+    if dataset:
+        ret['datasets'] = evict_dataset(dataset)
+    return flask.jsonify(ret)
+
+
+def init_app(app):
+    app.add_url_rule('/admin/cache', 'admin_cache', view_func=cache_stats)
+    app.add_url_rule('/admin/cache/evict', 'admin_cache_evict', view_func=evict, methods=['POST'])
@@ -17,7 +17,11 @@ def generate_forecast_series(historical_series, year_until):
 
 @calcfunc(
     datasets=dict(
-        buildings='jyrjola/aluesarjat/a01s_hki_rakennuskanta',
+        buildings=dict(
+            path='jyrjola/aluesarjat/a01s_hki_rakennuskanta',
+            filters=[('Alue', '==', '091 Helsinki')],
+            categories=['Alue', 'Valmistumisvuosi', 'Yksikkö'],
+        ),
     )
 )
 def prepare_historical_building_area_dataset(datasets):
@@ -79,8 +83,16 @@ def generate_building_floor_area_forecast(variables):
 
 @calcfunc(
     datasets=dict(
-        energy_use='jyrjola/ymparistotilastot/e12_helsingin_kaukolammon_sahkonkulutus',
-        building_stock='jyrjola/aluesarjat/a01s_hki_rakennuskanta'
+        energy_use=dict(
+            path='jyrjola/ymparistotilastot/e12_helsingin_kaukolammon_sahkonkulutus',
+            filters=[('Kunta', '==', 'Helsinki'), ('Energiamuoto', '==', 'Kaukolämpö')],
+            categories=['Kunta', 'Energiamuoto'],
+        ),
+        building_stock=dict(
+            path='jyrjola/aluesarjat/a01s_hki_rakennuskanta',
+            filters=[('Alue', '==', '091 Helsinki')],
+            categories=['Alue', 'Valmistumisvuosi', 'Yksikkö'],
+        ),
     ),
     variables=['municipality_name', 'target_year', 'district_heating_existing_building_efficiency_change']
 )
@@ -265,6 +265,7 @@ def predict_district_heating_emissions():
     from .geothermal import predict_geothermal_production
 
     pdf, fuel_use_df = calc_district_heating_unit_emissions_forecast()
+    pdf = pdf.copy()
     geodf = predict_geothermal_production()
     geodf = geodf[geodf.Forecast]
     pdf['GeothermalProduction'] = geodf['GeoEnergyProduction']
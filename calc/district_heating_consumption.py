@@ -10,7 +10,11 @@ from .buildings import (
 
 @calcfunc(
     datasets=dict(
-        energy_use='jyrjola/ymparistotilastot/e12_helsingin_kaukolammon_sahkonkulutus',
+        energy_use=dict(
+            path='jyrjola/ymparistotilastot/e12_helsingin_kaukolammon_sahkonkulutus',
+            filters=[('Kunta', '==', 'Helsinki'), ('Energiamuoto', '==', 'Kaukolämpö')],
+            categories=['Kunta', 'Energiamuoto'],
+        ),
     ),
     variables=['target_year'],
     funcs=[
@@ -20,7 +24,7 @@ from .buildings import (
     ]
 )
 def predict_district_heat_consumption(variables, datasets):
-    net_area = generate_building_floor_area_forecast()
+    net_area = generate_building_floor_area_forecast().copy()
     existing_heating_factor = generate_heat_use_per_net_area_forecast_existing_buildings()
     future_heating_factor = generate_heat_use_per_net_area_forecast_new_buildings()
 
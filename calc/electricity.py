@@ -11,7 +11,12 @@ from .solar_power import predict_solar_power_production
 @calcfunc(
     variables=['municipality_name', 'target_year'],
     datasets=dict(
-        ghg_emissions='jyrjola/hsy/pks_khk_paastot',
+        ghg_emissions=dict(
+            path='jyrjola/hsy/pks_khk_paastot',
+            columns=['Kaupunki', 'Vuosi', 'Sektori1', 'Päästöt', 'Energiankulutus'],
+            filters=[('Sektori1', '==', 'Sähkö')],
+            categories=['Kaupunki', 'Sektori1'],
+        ),
     )
 )
 def predict_electricity_emission_factor(variables, datasets):
@@ -178,7 +183,7 @@ def calculate_electricity_supply_emission_factor(datasets):
     ]
 )
 def predict_electricity_consumption_emissions():
-    cdf = predict_electricity_consumption()
+    cdf = predict_electricity_consumption().copy()
     udf = predict_electricity_emission_factor()
     sdf = predict_solar_power_production()
     cdf['EmissionFactor'] = udf['EmissionFactor']
@@ -174,7 +174,12 @@ def get_sector_by_path(path):
 
 @calcfunc(
     datasets=dict(
-        ghg_emissions='jyrjola/hsy/pks_khk_paastot',
+        ghg_emissions=dict(
+            path='jyrjola/hsy/pks_khk_paastot',
+            columns=['Kaupunki', 'Vuosi', 'Sektori1', 'Sektori2', 'Sektori3', 'Päästöt'],
+            filters=[('Kaupunki', '==', 'Helsinki')],
+            categories=['Kaupunki'],
+        ),
     ),
 )
 def prepare_emissions_dataset(datasets) -> pd.DataFrame:
@@ -222,7 +227,7 @@ def prepare_emissions_dataset(datasets) -> pd.DataFrame:
     ],
 )
 def predict_emissions(variables, datasets):
-    df = prepare_emissions_dataset()
+    df = prepare_emissions_dataset().copy()
     last_historical_year = df.index.max()
 
     for year in range(df.index.max() + 1, variables['target_year'] + 1):
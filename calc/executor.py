@@ -0,0 +1,137 @@
+import contextvars
+import importlib
+import logging
+import multiprocessing
+import threading
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from common import cache
+from variables import Scenario, get_scenario, use_scenario
+from .utils import ensure_imported, generate_cache_key, get_calcfuncs, get_func_closure, _unwrap
+
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def in_worker():
+    """Return True if running inside a task of the executor."""
+    return getattr(_local, 'in_worker', False)
+
+
+def _get_pool(max_workers, use_processes):
+    pool_key = (use_processes, max_workers)
+    with _pools_lock:
+        pool = _pools.get(pool_key)
+        if pool is None:
+            if use_processes:
+                # The workers are started with spawn instead of fork: forking
+                # a multi-threaded server process could copy locks held by
+                # other threads into the child.
+                pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+            else:
+                pool = ThreadPoolExecutor(max_workers=max_workers)
+            _pools[pool_key] = pool
+    return pool
+
+
+def _get_dependencies(func):
+    return [_unwrap(ensure_imported(x)) for x in func.calcfuncs or []]
+
+
+def _run_in_thread(wrapper, scenario, memo):
+    _local.in_worker = True
+    try:
+        with use_scenario(scenario), cache.memo_scope(memo):
+            wrapper()
+    finally:
+        _local.in_worker = False
+
+
+def _run_in_process(module_name, func_name, scenario, dep_values):
+    # The results of the dependencies are passed in the memo, because the
+    # process might not see the cache of the parent.
+    _local.in_worker = True
+    wrapper = getattr(importlib.import_module(module_name), func_name)
+    with use_scenario(scenario), cache.memo_scope(dict(dep_values)):
+        return wrapper()
+
+
+def compute_dependencies(func, var_store=None, memo=None, max_workers=4, use_processes=False):
+    """Compute all the calcfuncs that `func` depends on.
+
+    The dependencies are scheduled in topological order based on the
+    `funcs` declarations, and the independent ones are run concurrently in
+    a thread pool, or in a process pool if `use_processes` is set. The
+    workers see the variables of the caller and store the results in
+    `memo`, so calling `func` afterwards finds them there.
+
+    If a dependency fails, the functions depending on it are skipped and
+    the error surfaces when `func` itself is called.
+
+    The tasks take the computation locks of the dependencies, so the caller
+    must not hold any of them while waiting here.
+    """
+    func = _unwrap(func)
+    closure = get_func_closure(func)
+    scenario = get_scenario() if var_store is None else Scenario(var_store)
+    if memo is None:
+        memo = {}
+
+    wrappers = {_unwrap(x): x for x in get_calcfuncs()}
+    # The functions taking arguments are computed when the caller calls them
+    nodes = [x for x in closure['funcs'] if x is not func and x in wrappers and not x.requires_args]
+    if not nodes:
+        return
+
+    dependencies = {}
+    dependents = defaultdict(list)
+    for node in nodes:
+        deps = set(_get_dependencies(node)) & set(nodes)
+        dependencies[node] = deps
+        for dep in deps:
+            dependents[dep].append(node)
+    # Dependencies are removed from `remaining` as they finish
+    remaining = {node: set(deps) for node, deps in dependencies.items()}
+
+    keys = {}
+    if use_processes:
+        with use_scenario(scenario):
+            keys = {node: generate_cache_key(node) for node in nodes}
+
+    pool = _get_pool(max_workers, use_processes)
+    futures = {}
+
+    def submit(node):
+        if use_processes:
+            dep_values = {keys[x]: memo[keys[x]] for x in dependencies[node] if keys[x] in memo}
+            future = pool.submit(_run_in_process, node.__module__, node.__name__, scenario, dep_values)
+        else:
+            future = pool.submit(contextvars.copy_context().run, _run_in_thread, wrappers[node], scenario, memo)
+        futures[future] = node
+
+    for node, deps in dependencies.items():
+        if not deps:
+            submit(node)
+
+    while futures:
+        done, _ = wait(list(futures.keys()), return_when=FIRST_COMPLETED)
+        for future in done:
+            node = futures.pop(future)
+            try:
+                ret = future.result()
+            except Exception as e:
+                logger.info('Computing %s failed: %s' % (node.__name__, e))
+                continue
+            if use_processes:
+                memo[keys[node]] = ret
+
+            for dependent in dependents[node]:
+                deps = remaining[dependent]
+                deps.discard(node)
+                if not deps:
+                    submit(dependent)
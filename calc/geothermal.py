@@ -33,7 +33,12 @@ get_borehole_production = np.poly1d(np.polyfit(
 
 @calcfunc(
     datasets=dict(
-        ghg_emissions='jyrjola/hsy/pks_khk_paastot',
+        ghg_emissions=dict(
+            path='jyrjola/hsy/pks_khk_paastot',
+            columns=['Kaupunki', 'Vuosi', 'Sektori2', 'Energiankulutus'],
+            filters=[('Kaupunki', '==', 'Helsinki'), ('Sektori2', '==', 'Maalämpö')],
+            categories=['Kaupunki', 'Sektori2'],
+        ),
     ),
 )
 def get_historical_production(datasets):
@@ -46,7 +51,11 @@ def get_historical_production(datasets):
 
 @calcfunc(
     datasets=dict(
-        energy_use='jyrjola/ymparistotilastot/e12_helsingin_kaukolammon_sahkonkulutus',
+        energy_use=dict(
+            path='jyrjola/ymparistotilastot/e12_helsingin_kaukolammon_sahkonkulutus',
+            filters=[('Kunta', '==', 'Helsinki'), ('Energiamuoto', '==', 'Kaukolämpö')],
+            categories=['Kunta', 'Energiamuoto'],
+        ),
     ),
     variables=[
         'target_year', 'geothermal_heat_pump_cop',
@@ -5,7 +5,10 @@ from . import calcfunc
 @calcfunc(
     variables=['municipality_name'],
     datasets=dict(
-        pop_forecast='jyrjola/aluesarjat/hginseutu_va_ve01_vaestoennuste_pks',
+        pop_forecast=dict(
+            path='jyrjola/aluesarjat/hginseutu_va_ve01_vaestoennuste_pks',
+            categories=['Alue', 'Sukupuoli', 'Ikä', 'Laadintavuosi', 'Vaihtoehto'],
+        ),
     )
 )
 def prepare_population_forecast_dataset(variables, datasets):
@@ -219,8 +219,8 @@ def predict_newly_registered_cars(variables):
     variables=['target_year'],
 )
 def predict_cars_in_use_by_engine_type(variables):
-    df = prepare_cars_in_use_dataset()
-    in_use = predict_cars_in_use()
+    df = prepare_cars_in_use_dataset().copy()
+    in_use = predict_cars_in_use().copy()
 
     df['PHEV'] = df.pop('PHEV/diesel') + df.pop('PHEV/gasoline')
 
@@ -242,7 +242,7 @@ def predict_cars_in_use_by_engine_type(variables):
     # Predict starting point
     df = df.mul(in_use['NumberOfCars'], axis=0).dropna().astype(int)
 
-    new_df = predict_newly_registered_cars()
+    new_df = predict_newly_registered_cars().copy()
 
     in_use['FleetChange'] = in_use['NumberOfCars'].diff().shift(-1)
     in_use['RemoveOld'] = in_use['NewlyRegisteredCars'] - in_use['FleetChange']
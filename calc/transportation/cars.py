@@ -51,7 +51,7 @@ def predict_cars_mileage_old(variables):
     funcs=[predict_road_mileage, predict_population],
 )
 def predict_cars_mileage():
-    mdf = predict_road_mileage()
+    mdf = predict_road_mileage().copy()
     df = pd.DataFrame(mdf.pop('Forecast'))
     for vehicle, road in list(mdf.columns):
         if vehicle == 'Cars':
@@ -182,7 +182,7 @@ def predict_cars_emissions(datasets, variables):
     df = df.loc[df.Vehicle == 'Cars', ['Year', 'CO2e', 'Road']].set_index('Year')
     emissions_df = df.pivot(values='CO2e', columns='Road')
 
-    df = predict_cars_mileage()
+    df = predict_cars_mileage().copy()
     for road in ('Highways', 'Urban'):
         df[road + 'Emissions'] = emissions_df[road] / 1000  # -> kt
 
@@ -1,17 +1,72 @@
+import contextvars
 import importlib
+import glob
 import hashlib
+import inspect
 import os
 import json
-from functools import wraps
-
-from variables import get_variable
-from utils.quilt import load_datasets
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial, wraps
+
+import pandas as pd
+
+from variables import (
+    DEFAULT_VARIABLE_HASH, Scenario, get_scenario, get_variable, use_scenario
+)
+from utils.datasets import get_backend, load_datasets
+from utils.dataset_cache import DatasetCache
 from utils.perf import PerfCounter
 
-from common import cache
+from common import cache, metrics, settings
+from common.snapshot import SnapshotReader, SnapshotWriter
+
+
+logger = logging.getLogger(__name__)
+
+# How often (in seconds) the modification times of the calcfunc file
+# dependencies are checked.
+FILEDEP_CHECK_INTERVAL = 5
 
+_dataset_cache = DatasetCache(max_bytes=settings.DATASET_CACHE_MAX_BYTES)
 
-_dataset_cache = {}
+# The eviction epochs of the datasets are kept in the cache backend, so that
+# evict_dataset() drops the dataset in every process. The epochs of the
+# datasets loaded in this process by path:
+DATASET_EPOCHS_KEY = 'dataset-epochs'
+_dataset_epochs = {}
+
+# All the functions decorated with calcfunc
+_calcfuncs = []
+
+_filedep_lock = threading.Lock()
+_filedep_state = {
+    'checked_at': 0,
+    'generation': 0,
+    'mtimes': {},
+}
+
+# Versions of the datasets by path. The generation is bumped whenever a
+# version changes, so that the function fingerprints get recalculated.
+_dataset_versions_lock = threading.Lock()
+_dataset_versions = {
+    'generation': 0,
+    'versions': {},
+}
+
+# Results of the default scenario precomputed at build time
+_default_snapshot = {
+    'checked': False,
+    'reader': None,
+}
+
+# Set while a calcfunc is being computed. The calcfuncs it calls have
+# already been prefetched, see _prefetch_closure().
+_computing = contextvars.ContextVar('computing_calcfunc', default=False)
 
 
 _global_state = {
@@ -29,6 +84,12 @@ def ensure_imported(func):
     return func
 
 
+def _unwrap(func):
+    # The attributes set in calcfunc() live on the original function, so
+    # always resolve the wrapper returned by the decorator back to it.
+    return getattr(func, '__wrapped__', func)
+
+
 def _get_func_hash_data(func, seen_funcs):
     if seen_funcs is None:
         seen_funcs = set([func])
@@ -37,7 +98,8 @@ def _get_func_hash_data(func, seen_funcs):
     all_variables = set(variables.values())
 
     children = func.calcfuncs or []
-    children = [ensure_imported(x) for x in children]
+    children = [_unwrap(ensure_imported(x)) for x in children]
+    all_datasets = set(get_dataset_path(x) for x in (func.datasets or {}).values())
     all_funcs = set(children)
 
     for child in children:
@@ -47,10 +109,15 @@ def _get_func_hash_data(func, seen_funcs):
         hash_data = _get_func_hash_data(child, seen_funcs)
         all_variables.update(hash_data['variables'])
         all_funcs.update(hash_data['funcs'])
+        all_datasets.update(hash_data['datasets'])
 
     all_funcs.add(func)
 
-    return dict(variables=all_variables, funcs=all_funcs)
+    return dict(variables=all_variables, funcs=all_funcs, datasets=all_datasets)
+
+
+def _get_func_name(func):
+    return '.'.join((func.__module__, func.__name__))
 
 
 def _hash_funcs(funcs):
@@ -59,35 +126,606 @@ def _hash_funcs(funcs):
         _global_state['debug'] = False
 
     m = hashlib.md5()
-    for f in funcs:
+    # Sort by name so that all the worker processes end up with the same hash.
+    for f in sorted(funcs, key=_get_func_name):
         m.update(f.__code__.co_code)
-        if f.filedeps:
-            for fn in f.filedeps:
-                update_time = os.path.getmtime(fn)
-                m.update(bytes(str(update_time), encoding='ascii'))
     return m.hexdigest()
 
 
-def generate_cache_key(func, var_store=None):
-    hash_data = _get_func_hash_data(func, None)
-    # print(hash_data)
+def _check_filedeps():
+    """Refresh the modification times of the file dependencies.
+
+    The files are stat'ed at most every FILEDEP_CHECK_INTERVAL seconds. If any
+    of them has changed, the filedep generation is bumped so that the function
+    fingerprints get recalculated.
+    """
+    now = time.monotonic()
+    if now - _filedep_state['checked_at'] < FILEDEP_CHECK_INTERVAL:
+        return _filedep_state['generation']
+
+    with _filedep_lock:
+        if now - _filedep_state['checked_at'] < FILEDEP_CHECK_INTERVAL:
+            return _filedep_state['generation']
+
+        mtimes = _filedep_state['mtimes']
+        changed = False
+        for fn in list(mtimes.keys()):
+            update_time = os.path.getmtime(fn)
+            if mtimes[fn] != update_time:
+                mtimes[fn] = update_time
+                changed = True
+        if changed:
+            _filedep_state['generation'] += 1
+        _filedep_state['checked_at'] = now
+
+    return _filedep_state['generation']
+
+
+def get_dataset_path(spec):
+    if isinstance(spec, str):
+        return spec
+    return spec['path']
+
+
+def get_dataset_version(path):
+    """Return the version of the dataset at `path`.
+
+    The version is asked from the dataset backend on first use and it stays
+    the same until it's changed with set_dataset_version(). An empty string
+    means that the backend can't tell the version.
+    """
+    version = _dataset_versions['versions'].get(path)
+    if version is None:
+        version = get_backend().get_version(path) or ''
+        with _dataset_versions_lock:
+            version = _dataset_versions['versions'].setdefault(path, version)
+    return version
+
+
+def set_dataset_version(path, version):
+    """Switch to another version of the dataset at `path`.
+
+    The cache keys of all the calcfuncs using the dataset change accordingly.
+    """
+    with _dataset_versions_lock:
+        versions = _dataset_versions['versions']
+        if versions.get(path) == version:
+            return
+        versions[path] = version
+        _dataset_versions['generation'] += 1
+
+
+def get_func_closure(func):
+    """Return the transitive variables, datasets and the code fingerprint of a calcfunc.
+
+    The dependency graph is walked only once per function; the result is
+    stored in the `closure` attribute of the function.
+    """
+    func = _unwrap(func)
+    closure = getattr(func, 'closure', None)
+    if closure is not None:
+        return closure
 
+    hash_data = _get_func_hash_data(func, None)
     funcs = hash_data['funcs']
-    variables = hash_data['variables']
-    var_data = json.dumps({x: get_variable(x, var_store=var_store) for x in variables}, sort_keys=True)
 
-    func_hash = _hash_funcs(funcs)
-    func_name = '.'.join((func.__module__, func.__name__))
+    filedeps = set()
+    for f in funcs:
+        filedeps.update(f.filedeps or [])
+    with _filedep_lock:
+        for fn in filedeps:
+            if fn not in _filedep_state['mtimes']:
+                _filedep_state['mtimes'][fn] = os.path.getmtime(fn)
+
+    closure = dict(
+        name=_get_func_name(func),
+        variables=tuple(sorted(hash_data['variables'])),
+        datasets=tuple(sorted(hash_data['datasets'])),
+        funcs=funcs,
+        filedeps=tuple(sorted(filedeps)),
+        code_hash=_hash_funcs(funcs),
+        # Results that don't depend on the scenario are the same for everyone
+        tier=cache.SHARED if hash_data['variables'] else cache.PINNED,
+        func_hash=None,
+        generation=None,
+    )
+    func.closure = closure
+    return closure
+
+
+def _get_func_hash(closure):
+    # The hash covers the code of the functions, the modification times of
+    # their file dependencies and the versions of their datasets.
+    generation = (_check_filedeps(), _dataset_versions['generation'])
+    if closure['generation'] == generation:
+        return closure['func_hash']
+
+    if not closure['filedeps'] and not closure['datasets']:
+        func_hash = closure['code_hash']
+    else:
+        m = hashlib.md5(closure['code_hash'].encode('ascii'))
+        mtimes = _filedep_state['mtimes']
+        for fn in closure['filedeps']:
+            m.update(bytes(str(mtimes[fn]), encoding='ascii'))
+        for path in closure['datasets']:
+            m.update(('%s@%s' % (path, get_dataset_version(path))).encode('utf8'))
+        func_hash = m.hexdigest()
+
+    closure['func_hash'] = func_hash
+    closure['generation'] = generation
+    return func_hash
+
+
+def _get_scenario(var_store):
+    if var_store is not None:
+        return Scenario(var_store)
+    return get_scenario()
+
+
+def generate_cache_key(func, var_store=None):
+    closure = get_func_closure(func)
+
+    # The scenario caches the hashes of the variable values, so the values
+    # are serialized only once per request.
+    var_hash = _get_scenario(var_store).get_values_hash(closure['variables'])
+    func_hash = _get_func_hash(closure)
+
+    return '%s:%s:%s' % (closure['name'], var_hash, func_hash)
+
+
+def is_default_scenario(func, var_store=None):
+    """Return True if all the variables the calcfunc depends on have their default values."""
+    closure = get_func_closure(func)
+    return _get_scenario(var_store).is_default(closure['variables'])
+
+
+class _UnhashableArgument(Exception):
+    pass
+
+
+# Time spent hashing the arguments of calcfunc calls, by function name
+_arg_hash_lock = threading.Lock()
+_arg_hash_stats = {}
+
+
+def _update_arg_hash(m, val):
+    if isinstance(val, (pd.DataFrame, pd.Series, pd.Index)):
+        size = val.memory_usage()
+        if isinstance(val, pd.DataFrame):
+            size = size.sum()
+            m.update(repr((list(val.columns), [str(x) for x in val.dtypes])).encode('utf8'))
+        elif isinstance(val, pd.Series):
+            m.update(repr((val.name, str(val.dtype))).encode('utf8'))
+        if size > settings.CALC_ARG_HASH_MAX_BYTES:
+            raise _UnhashableArgument('%s of %d bytes is too large to hash' % (type(val).__name__, size))
+        if not isinstance(val, pd.Index):
+            m.update(repr(list(val.index.names)).encode('utf8'))
+        try:
+            hashes = pd.util.hash_pandas_object(val, index=True)
+        except (TypeError, ValueError) as e:
+            raise _UnhashableArgument(str(e))
+        m.update(hashes.values.tobytes())
+    elif val is None or isinstance(val, (str, bytes, bool, int, float)):
+        m.update(('%s:%r;' % (type(val).__name__, val)).encode('utf8'))
+    elif isinstance(val, (list, tuple)):
+        m.update(('%s[' % type(val).__name__).encode('utf8'))
+        for item in val:
+            _update_arg_hash(m, item)
+        m.update(b']')
+    elif isinstance(val, dict):
+        m.update(b'dict{')
+        for key in sorted(val.keys(), key=repr):
+            _update_arg_hash(m, key)
+            _update_arg_hash(m, val[key])
+        m.update(b'}')
+    else:
+        raise _UnhashableArgument('%s arguments are not supported' % type(val).__name__)
+
+
+def _hash_call_args(func, args, kwargs):
+    """Return a hash of the arguments of a calcfunc call.
+
+    DataFrames, Series and Indexes are hashed by their contents. Returns None
+    if an argument can't be hashed or is larger than CALC_ARG_HASH_MAX_BYTES,
+    in which case the call is not cached.
+    """
+    start = time.perf_counter()
+    m = hashlib.md5()
+    try:
+        _update_arg_hash(m, args)
+        _update_arg_hash(m, kwargs)
+        ret = m.hexdigest()
+    except _UnhashableArgument as e:
+        logger.debug('Not caching %s: %s' % (func.__name__, e))
+        ret = None
+    elapsed = time.perf_counter() - start
+
+    func_name = _get_func_name(func)
+    with _arg_hash_lock:
+        stats = _arg_hash_stats.setdefault(func_name, dict(calls=0, unhashable=0, seconds=0.0))
+        stats['calls'] += 1
+        stats['seconds'] += elapsed
+        if ret is None:
+            stats['unhashable'] += 1
+    return ret
+
+
+def get_arg_hash_stats():
+    """Return the number of argument hashings and the time spent on them by calcfunc."""
+    with _arg_hash_lock:
+        return {func_name: dict(stats) for func_name, stats in _arg_hash_stats.items()}
+
+
+def _requires_args(func):
+    params = inspect.signature(func).parameters.values()
+    return any(
+        p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD) and p.default is p.empty
+        and p.name not in ('variables', 'datasets')
+        for p in params
+    )
+
+
+def get_dataset_key(spec, version=None):
+    """Return the dataset cache key for a dataset spec.
+
+    A spec is either a dataset path or a dict with the `path` and optionally
+    `columns` and `filters` to apply when loading the dataset, and the
+    `categories` to convert to the category dtype. If `version` is given,
+    it's included in the key.
+    """
+    key = get_dataset_path(spec)
+    if not isinstance(spec, str):
+        opts = {key: spec[key] for key in ('columns', 'filters', 'categories') if spec.get(key)}
+        if opts:
+            key = '%s?%s' % (key, json.dumps(opts, sort_keys=True, ensure_ascii=False))
+    if version:
+        key = '%s@%s' % (key, version)
+    return key
+
+
+def _load_dataset(spec, version=None, should_profile=False):
+    if should_profile:
+        ds_pc = PerfCounter('dataset %s' % get_dataset_key(spec, version))
+
+    start = time.perf_counter()
+    if isinstance(spec, str):
+        df = load_datasets(spec, version=version)
+    else:
+        df = load_datasets(
+            spec['path'], columns=spec.get('columns'), filters=spec.get('filters'),
+            categories=spec.get('categories'), version=version,
+        )
+    metrics.observe_dataset_load(get_dataset_path(spec), time.perf_counter() - start)
+
+    if should_profile:
+        ds_pc.display('loaded')
+        del ds_pc
+    return df
+
+
+def _get_dataset(spec, should_profile=False):
+    path = get_dataset_path(spec)
+    epoch = cache.get_epoch(DATASET_EPOCHS_KEY, path)
+    if _dataset_epochs.get(path, 0) != epoch:
+        # Evicted by evict_dataset(), possibly in another process
+        _evict_local_dataset(path)
+        _dataset_epochs[path] = epoch
+
+    version = get_dataset_version(path) or None
+    return _dataset_cache.get_or_load(
+        get_dataset_key(spec, version), partial(_load_dataset, spec, version, should_profile)
+    )
+
+
+def _call_calcfunc(func, args, kwargs, var_store, should_profile):
+    variables = func.variables
+    datasets = func.datasets
+
+    if variables is not None:
+        kwargs['variables'] = {x: get_variable(y, var_store=var_store) for x, y in variables.items()}
+
+    if datasets is not None:
+        kwargs['datasets'] = {
+            ds_name: _get_dataset(spec, should_profile) for ds_name, spec in datasets.items()
+        }
+
+    return func(*args, **kwargs)
+
+
+def _compute(func, args, kwargs, var_store, should_profile):
+    token = _computing.set(True)
+    try:
+        return _call_calcfunc(func, args, kwargs, var_store, should_profile)
+    finally:
+        _computing.reset(token)
+
+
+def _compute_dependencies(func, var_store):
+    """Compute the calcfuncs `func` depends on concurrently into the memo.
+
+    This must be called without holding any computation locks: the executor
+    tasks take the locks of the dependencies, which might be held by other
+    requests. Calls made during a computation (or inside the executor) run
+    the dependencies inline, so nobody waits for the executor while holding
+    a lock.
+    """
+    from calc import executor
+
+    if not settings.CALC_PARALLEL_WORKERS or not func.calcfuncs or _computing.get() or executor.in_worker():
+        return
+
+    token = _computing.set(True)
+    try:
+        executor.compute_dependencies(
+            func, var_store=var_store, memo=cache.get_memo(), max_workers=settings.CALC_PARALLEL_WORKERS,
+            use_processes=settings.CALC_PARALLEL_PROCESSES,
+        )
+    finally:
+        _computing.reset(token)
+
+
+def _import_calc_modules():
+    # Import all the modules under calc/ so that every calcfunc gets registered
+    calc_path = os.path.dirname(os.path.abspath(__file__))
+    base_path = os.path.dirname(calc_path)
+    for mod_file in glob.glob(os.path.join(calc_path, '**', '*.py'), recursive=True):
+        mod_path, _ = os.path.splitext(os.path.relpath(mod_file, base_path))
+        parts = mod_path.split(os.sep)
+        if parts[-1] == '__init__':
+            parts.pop()
+        importlib.import_module('.'.join(parts))
+
+
+def _load_dataset_timed(spec):
+    # A dataset that fails to load must not keep the app from starting;
+    # the calcfuncs using it will fail when called instead.
+    start = time.perf_counter()
+    try:
+        _get_dataset(spec)
+    except Exception:
+        logger.exception('Preloading dataset %s failed' % get_dataset_key(spec))
+        return None
+    return time.perf_counter() - start
+
+
+def get_calcfuncs():
+    """Return all the functions decorated with calcfunc."""
+    return list(_calcfuncs)
+
+
+def get_dataset_specs():
+    """Return the specs of all the datasets declared by calcfuncs by dataset key."""
+    _import_calc_modules()
+
+    dataset_specs = {}
+    for func in _calcfuncs:
+        for spec in (_unwrap(func).datasets or {}).values():
+            dataset_specs[get_dataset_key(spec)] = spec
+    return dataset_specs
+
+
+def _get_dataset_key_path(key):
+    return re.split(r'[?@]', key, 1)[0]
+
+
+def get_dataset_cache_stats():
+    """Return the memory used by the datasets loaded in this process, by dataset path."""
+    stats = _dataset_cache.get_stats()
+    by_path = {}
+    for key, entry in stats['datasets'].items():
+        ds = by_path.setdefault(_get_dataset_key_path(key), dict(variants=0, size=0, hits=0))
+        ds['variants'] += 1
+        ds['size'] += entry['size']
+        ds['hits'] += entry['hits']
+    stats['by_path'] = by_path
+    return stats
+
+
+def _evict_local_dataset(path):
+    keys = [key for key in _dataset_cache.keys() if _get_dataset_key_path(key) == path]
+    for key in keys:
+        _dataset_cache.delete(key)
+    return len(keys)
+
+
+def evict_dataset(path):
+    """Drop all the loaded variants of a dataset from the dataset caches.
+
+    The variants are dropped from this process right away and from the
+    other processes sharing the cache backend within
+    cache.EPOCH_CHECK_INTERVAL seconds. With the in-process cache backend,
+    this affects only the current process. The dataset is loaded again when
+    it's next needed. Returns the number of variants dropped in this process.
+    """
+    cache.bump_epoch(DATASET_EPOCHS_KEY, path)
+    _dataset_epochs[path] = cache.get_epoch(DATASET_EPOCHS_KEY, path)
+    return _evict_local_dataset(path)
+
+
+def preload_datasets(max_workers=8):
+    """Load all the datasets declared by calcfuncs into the dataset cache.
+
+    This is meant to be run at startup so that the first requests don't
+    have to wait for the datasets to load. Returns the load time of each
+    dataset in seconds, or None if loading the dataset failed.
+    """
+    dataset_specs = get_dataset_specs()
+    dataset_names = sorted(dataset_specs.keys())
+    if not dataset_names:
+        return {}
+
+    pc = PerfCounter('preload datasets')
+    pc.display('loading %d datasets' % len(dataset_names))
+
+    load_times = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(_load_dataset_timed, [dataset_specs[x] for x in dataset_names])
+        for dataset_name, load_time in zip(dataset_names, results):
+            load_times[dataset_name] = load_time
+            if load_time is None:
+                pc.display('%s failed' % dataset_name)
+            else:
+                pc.display('%s loaded in %.1f ms' % (dataset_name, load_time * 1000))
+
+    pc.display('done')
+    return load_times
+
+
+def refresh_datasets():
+    """Switch to the newest versions of the datasets in use.
+
+    The new version of a dataset is loaded into the dataset cache before
+    switching to it, so the calcfuncs don't have to wait for it. Switching
+    changes the cache keys of only the calcfuncs that use the dataset.
+    Returns the paths of the updated datasets.
+    """
+    backend = get_backend()
+    specs_by_path = {}
+    for spec in get_dataset_specs().values():
+        specs_by_path.setdefault(get_dataset_path(spec), []).append(spec)
+
+    updated = []
+    for path, old_version in list(_dataset_versions['versions'].items()):
+        try:
+            version = backend.get_version(path) or ''
+            if version == old_version:
+                continue
+            # Load only the variants of the dataset that are in use
+            old_keys = [get_dataset_key(spec, old_version) for spec in specs_by_path.get(path, [])]
+            for spec, old_key in zip(specs_by_path.get(path, []), old_keys):
+                if old_key in _dataset_cache:
+                    _dataset_cache.get_or_load(
+                        get_dataset_key(spec, version), partial(_load_dataset, spec, version or None)
+                    )
+        except Exception:
+            logger.exception('Refreshing dataset %s failed' % path)
+            continue
+
+        set_dataset_version(path, version)
+        for old_key in old_keys:
+            _dataset_cache.delete(old_key)
+        logger.info('Dataset %s updated to version %s' % (path, version))
+        updated.append(path)
+
+    return updated
+
+
+def _refresh_datasets_periodically(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            refresh_datasets()
+        except Exception:
+            logger.exception('Refreshing datasets failed')
+
+
+def start_dataset_refresher(interval):
+    """Check for new dataset versions every `interval` seconds in a background thread."""
+    thread = threading.Thread(
+        target=_refresh_datasets_periodically, args=(interval,), name='dataset-refresher', daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def get_default_snapshot_path():
+    return os.path.join(settings.DEFAULT_SNAPSHOT_DIR, DEFAULT_VARIABLE_HASH)
+
+
+def _get_default_snapshot():
+    if not _default_snapshot['checked']:
+        path = get_default_snapshot_path()
+        if os.path.isdir(path):
+            _default_snapshot['reader'] = SnapshotReader(path, cache.get_codec())
+        _default_snapshot['checked'] = True
+    return _default_snapshot['reader']
+
+
+def build_default_snapshot(funcs):
+    """Compute `funcs` and all the calcfuncs they depend on for the default variables.
+
+    The results are stored in the default snapshot, from which the calcfuncs
+    are served until the cache has them. Returns the number of stored results.
+    """
+    wrappers = {_unwrap(func): func for func in _calcfuncs}
+    all_funcs = set()
+    for func in funcs:
+        all_funcs.update(x for x in get_func_closure(func)['funcs'] if not x.requires_args)
+
+    pc = PerfCounter('default snapshot')
+    writer = SnapshotWriter(get_default_snapshot_path(), cache.get_codec())
+    count = 0
+    with cache.memo_scope():
+        for func in sorted(all_funcs, key=_get_func_name):
+            func_name = _get_func_name(func)
+            try:
+                ret = wrappers[func]()
+            except Exception:
+                logger.exception('Computing %s failed' % func_name)
+                continue
+            size = writer.put(generate_cache_key(func), ret)
+            pc.display('%s: %d bytes' % (func_name, size))
+            count += 1
+    writer.commit()
+    _default_snapshot['checked'] = False
+    pc.display('done')
+    return count
+
+
+def _prefetch_closure(func, cache_key, cache_tier, var_store):
+    """Fetch the cached values of `func` and every calcfunc it depends on into the memo.
+
+    The keys are generated from the declared `funcs` graph and fetched in
+    one round-trip, so a fully cached call doesn't have to go to the cache
+    for every dependency in turn.
+    """
+    memo = cache.get_memo()
+    if memo is None:
+        return
+
+    key_tiers = {cache_key: cache_tier}
+    for dep in get_func_closure(func)['funcs']:
+        if dep is func or dep.requires_args:
+            continue
+        key = generate_cache_key(dep, var_store=var_store)
+        if key not in memo:
+            key_tiers[key] = get_func_closure(dep)['tier']
+
+    memo.update(cache.lookup_many(key_tiers))
+
+
+def _revalidate_in_background(func, cache_key, cache_tier, var_store, args=(), kwargs=None):
+    # The background thread has no access to the request session, so pass
+    # the scenario to it explicitly.
+    scenario = _get_scenario(var_store)
+    kwargs = dict(kwargs or {})
+
+    @contextmanager
+    def context():
+        with use_scenario(scenario), cache.memo_scope():
+            # Like in the foreground, the dependencies are computed before
+            # taking the computation lock.
+            _compute_dependencies(func, None)
+            yield None
 
-    return '%s:%s:%s' % (func_name, hashlib.md5(var_data.encode()).hexdigest(), func_hash)
+    def compute():
+        return _compute(func, args, kwargs, None, False)
 
+    cache.revalidate(cache_key, compute, tier=cache_tier, context=context)
 
-def calcfunc(variables=None, datasets=None, funcs=None, filedeps=None):
+
+def calcfunc(variables=None, datasets=None, funcs=None, filedeps=None, cache_args=True):
     if datasets is not None:
         assert isinstance(datasets, (list, tuple, dict))
         if not isinstance(datasets, dict):
             datasets = {x: x for x in datasets}
 
+        for spec in datasets.values():
+            assert isinstance(spec, (str, dict))
+            if isinstance(spec, dict):
+                assert isinstance(spec['path'], str)
+                assert not set(spec.keys()) - set(['path', 'columns', 'filters', 'categories'])
+
     if variables is not None:
         assert isinstance(variables, (list, tuple, dict))
         if not isinstance(variables, dict):
@@ -113,6 +751,10 @@ def calcfunc(variables=None, datasets=None, funcs=None, filedeps=None):
         func.datasets = datasets
         func.calcfuncs = funcs
         func.filedeps = filedeps
+        func.cache_args = cache_args
+        # Functions that need arguments can't be computed on their own
+        func.requires_args = _requires_args(func)
+        func_metrics = metrics.CalcFuncMetrics(_get_func_name(func))
 
         @wraps(func)
         def wrap_calc_func(*args, **kwargs):
@@ -129,58 +771,115 @@ def calcfunc(variables=None, datasets=None, funcs=None, filedeps=None):
             # if func.__name__ == 'predict_ev_charging_station_demand':
             #    _global_state['debug'] = True
 
+            func_metrics.calls.inc()
+            keygen_start = time.perf_counter()
             cache_key = generate_cache_key(func, var_store=var_store)
+            cache_tier = get_func_closure(func)['tier']
 
             assert 'variables' not in kwargs
             assert 'datasets' not in kwargs
 
             unknown_kwargs = set(kwargs.keys()) - set(['step_callback'])
-            if not args and not unknown_kwargs and not skip_cache:
-                should_cache_func = True
-            else:
-                should_cache_func = False
-
-            if should_cache_func:
-                ret = cache.get(cache_key)
-                if ret is not None:  # calcfuncs must not return None
+            arg_kwargs = {x: kwargs[x] for x in unknown_kwargs}
+            should_cache_func = not skip_cache
+            if should_cache_func and (args or arg_kwargs):
+                args_hash = _hash_call_args(func, args, arg_kwargs) if func.cache_args else None
+                if should_profile:
+                    pc.display('arguments hashed (%s)' % args_hash)
+                if args_hash is None:
+                    should_cache_func = False
+                else:
+                    cache_key = '%s:%s' % (cache_key, args_hash)
+                    # Only the latest result of a function is pinned, so
+                    # results for different arguments would replace each other.
+                    cache_tier = cache.SHARED
+            func_metrics.keygen_time.observe(time.perf_counter() - keygen_start)
+
+            if not should_cache_func:
+                func_metrics.record_result(metrics.UNCACHED)
+                with func_metrics.compute_time.time():
+                    ret = _call_calcfunc(func, args, kwargs, var_store, should_profile)
+                if should_profile:
+                    pc.display('func ret (cache key %s)' % cache_key)
+                return ret
+
+            ret = cache.memo_get(cache_key)
+            if ret is not None:
+                func_metrics.record_result(metrics.MEMO)
+                if should_profile:
+                    pc.display('memo hit (%s)' % cache_key)
+                return ret
+
+            if func.calcfuncs and not _computing.get():
+                _prefetch_closure(func, cache_key, cache_tier, var_store)
+                ret = cache.memo_get(cache_key)
+                if ret is not None:
+                    func_metrics.record_result(metrics.PREFETCH)
                     if should_profile:
-                        pc.display('cache hit (%s)' % cache_key)
+                        pc.display('prefetch hit (%s)' % cache_key)
                     return ret
-                if only_if_in_cache:
-                    if should_profile:
-                        pc.display('cache miss so leaving as requested (%s)' % cache_key)
-                    return None
-
-            if variables is not None:
-                kwargs['variables'] = {x: get_variable(y, var_store=var_store) for x, y in variables.items()}
+                if should_profile:
+                    pc.display('prefetched closure')
 
-            if datasets is not None:
-                datasets_to_load = set(list(datasets.values())) - set(_dataset_cache.keys())
-                if datasets_to_load:
-                    loaded_datasets = []
-                    for dataset_name in datasets_to_load:
+            ret, state = cache.lookup(cache_key, tier=cache_tier)
+            if ret is not None:  # calcfuncs must not return None
+                func_metrics.record_result(metrics.STALE if state == cache.STALE else metrics.HIT)
+                if state == cache.STALE:
+                    if should_profile:
+                        pc.display('stale cache hit (%s)' % cache_key)
+                    _revalidate_in_background(func, cache_key, cache_tier, var_store, args, arg_kwargs)
+                elif should_profile:
+                    pc.display('cache hit (%s)' % cache_key)
+                return cache.memo_set(cache_key, ret)
+
+            snapshot = _get_default_snapshot()
+            ret = snapshot.get(cache_key) if snapshot is not None else None
+            if ret is not None:
+                func_metrics.record_result(metrics.SNAPSHOT)
+                if should_profile:
+                    pc.display('snapshot hit (%s)' % cache_key)
+                cache.set(cache_key, ret, tier=cache_tier)
+                return cache.memo_set(cache_key, ret)
+
+            if only_if_in_cache:
+                func_metrics.record_result(metrics.MISS)
+                if should_profile:
+                    pc.display('cache miss so leaving as requested (%s)' % cache_key)
+                return None
+
+            with cache.memo_scope():
+                compute_start = time.perf_counter()
+                # The dependencies are computed before taking the lock, see
+                # _compute_dependencies().
+                _compute_dependencies(func, var_store)
+
+                # Make sure only one thread or process computes the result at a time.
+                # The others wait for it to finish and then pick the result from
+                # the cache.
+                with cache.computation_lock(cache_key):
+                    ret = cache.get(cache_key, tier=cache_tier)
+                    if ret is not None:
+                        func_metrics.record_result(metrics.COALESCED)
                         if should_profile:
-                            ds_pc = PerfCounter('dataset %s' % dataset_name)
-                        df = load_datasets(dataset_name)
+                            pc.display('cache hit after wait (%s)' % cache_key)
+                    else:
+                        func_metrics.record_result(metrics.MISS)
+                        ret = _compute(func, args, kwargs, var_store, should_profile)
+                        func_metrics.compute_time.observe(time.perf_counter() - compute_start)
                         if should_profile:
-                            ds_pc.display('loaded')
-                            del ds_pc
-                        loaded_datasets.append(df)
-
-                    for dataset_name, dataset in zip(datasets_to_load, loaded_datasets):
-                        _dataset_cache[dataset_name] = dataset
-
-                kwargs['datasets'] = {ds_name: _dataset_cache[ds_url] for ds_name, ds_url in datasets.items()}
-
-            ret = func(*args, **kwargs)
-
-            if should_profile:
-                pc.display('func ret (cache key %s)' % cache_key)
-            if should_cache_func:
-                assert ret is not None
-                cache.set(cache_key, ret, timeout=600)
-
-            return ret
+                            pc.display('func ret (cache key %s)' % cache_key)
+                        assert ret is not None
+                        # Results of the default scenario are needed by everyone,
+                        # the others only once the scenario proves popular.
+                        if is_default_scenario(func, var_store):
+                            admission_key = None
+                        else:
+                            admission_key = _get_scenario(var_store).hash
+                        cache.set(cache_key, ret, tier=cache_tier, admission_key=admission_key)
+
+                return cache.memo_set(cache_key, ret)
+
+        _calcfuncs.append(wrap_calc_func)
 
         return wrap_calc_func
 
@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+import flask
+
+from common import cache, settings
+from variables import get_changed_variables, override_variables
+
+
+logger = logging.getLogger(__name__)
+
+# Niceness of the warmer thread. On Linux it applies only to the calling
+# thread, not the whole process.
+WARMER_NICENESS = 10
+# Dash sends the callbacks of the pages to this endpoint
+DASH_CALLBACK_PATH = '/_dash-update-component'
+
+
+class ScenarioPopularity:
+    """Count how often each scenario is seen.
+
+    A scenario is the set of variables that differ from their defaults.
+    The counts are halved on every decay(), so old popularity fades away.
+    """
+
+    def __init__(self, max_scenarios=1000):
+        self.max_scenarios = max_scenarios
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, scenario):
+        key = json.dumps(scenario, sort_keys=True)
+        with self._lock:
+            self._counts[key] += 1
+            if len(self._counts) > 2 * self.max_scenarios:
+                self._counts = Counter(dict(self._counts.most_common(self.max_scenarios)))
+
+    def get_top(self, n):
+        with self._lock:
+            return [json.loads(key) for key, _ in self._counts.most_common(n)]
+
+    def decay(self):
+        with self._lock:
+            self._counts = Counter({key: count // 2 for key, count in self._counts.items() if count > 1})
+
+
+class CacheWarmer:
+    """Recompute the calcfuncs of the pages for the most popular scenarios.
+
+    The warmer sleeps after each calcfunc so that it uses at most
+    `cpu_budget` of one CPU, leaving the rest for the live callbacks.
+    """
+
+    def __init__(self, popularity, top_n, interval, cpu_budget):
+        self.popularity = popularity
+        self.top_n = top_n
+        self.interval = interval
+        self.cpu_budget = cpu_budget
+
+    def warm_scenario(self, funcs, scenario):
+        with override_variables(scenario), cache.memo_scope(), cache.admit_all():
+            for func in funcs:
+                start = time.thread_time()
+                try:
+                    func()
+                except Exception:
+                    logger.exception('Warming %s for scenario %s failed' % (func.__name__, scenario))
+                spent = time.thread_time() - start
+                time.sleep(spent * (1 - self.cpu_budget) / self.cpu_budget)
+
+    def warm(self):
+        from pages.routing import get_page_calcfuncs
+
+        funcs = sorted(get_page_calcfuncs(), key=lambda x: (x.__module__, x.__name__))
+        for scenario in self.popularity.get_top(self.top_n):
+            self.warm_scenario(funcs, scenario)
+        self.popularity.decay()
+
+    def run(self):
+        try:
+            os.nice(WARMER_NICENESS)
+        except OSError:
+            pass
+
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.warm()
+            except Exception:
+                logger.exception('Warming the cache failed')
+
+
+_popularity = ScenarioPopularity()
+
+
+def _record_scenario(response):
+    # The pages are computed in the Dash callbacks, so skip the other
+    # requests, e.g. the static files, /metrics and /admin/.
+    if not flask.request.path.endswith(DASH_CALLBACK_PATH):
+        return response
+    # Skip the sessions that haven't touched the variables
+    if '_default_variable_hash' in flask.session:
+        scenario = get_changed_variables()
+        if scenario:
+            _popularity.record(scenario)
+    return response
+
+
+def init_app(app):
+    """Record the scenarios of the requests and start warming the cache for them."""
+    app.after_request(_record_scenario)
+
+    warmer = CacheWarmer(
+        _popularity, top_n=settings.WARMER_TOP_SCENARIOS, interval=settings.WARMER_INTERVAL,
+        cpu_budget=settings.WARMER_CPU_BUDGET,
+    )
+    thread = threading.Thread(target=warmer.run, name='cache-warmer', daemon=True)
+    thread.start()
+    return warmer
@@ -0,0 +1,30 @@
+import time
+
+
+class Doorkeeper:
+    """Admit scenarios to the cache only after they have been seen before.
+
+    The time each scenario was first seen is kept in the cache `backend`,
+    so all the processes sharing the backend make the same decisions. Dash
+    sends the callbacks of a page load at the same time, so a scenario
+    counts as seen before only `min_age` seconds after it was first seen.
+    Scenarios are forgotten `window` seconds after they were first seen.
+    """
+
+    KEY_PREFIX = 'seen-scenario:'
+
+    def __init__(self, backend, window, min_age):
+        self.backend = backend
+        self.window = window
+        self.min_age = min_age
+
+    def admit(self, scenario_hash):
+        key = self.KEY_PREFIX + scenario_hash
+        now = time.time()
+        if self.backend.add(key, now, timeout=self.window):
+            return False
+        first_seen = self.backend.get(key)
+        if first_seen is None:
+            # Expired after the add() above
+            return False
+        return now - first_seen >= self.min_age
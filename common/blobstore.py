@@ -0,0 +1,114 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import pyarrow as pa
+
+
+logger = logging.getLogger(__name__)
+
+# Check the total size of the store after this many writes
+PRUNE_INTERVAL = 20
+
+
+class BlobStore:
+    """Content-addressed file store for large cached values.
+
+    The blobs are memory-mapped when read, so all the processes on the node
+    share the same pages and nothing is copied until the data is modified.
+    """
+
+    def __init__(self, root, max_bytes=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _get_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, data):
+        digest = hashlib.sha1(data).hexdigest()
+        path = self._get_path(digest)
+        if os.path.exists(path):
+            os.utime(path)
+            return digest
+
+        dir_path = os.path.dirname(path)
+        os.makedirs(dir_path, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+        with self._lock:
+            self._writes += 1
+            should_prune = self._writes % PRUNE_INTERVAL == 0
+        if should_prune:
+            self.prune()
+
+        return digest
+
+    def get(self, digest):
+        """Return a memory-mapped buffer for the blob or None if it doesn't exist."""
+        path = self._get_path(digest)
+        try:
+            mm = pa.memory_map(path, 'r')
+        except OSError:
+            return None
+        # Keep recently used blobs from being pruned
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return mm.read_buffer()
+
+    def delete(self, digest):
+        try:
+            os.unlink(self._get_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def list_blobs(self):
+        out = []
+        for dir_entry in os.scandir(self.root):
+            if not dir_entry.is_dir():
+                continue
+            for entry in os.scandir(dir_entry.path):
+                if entry.name.startswith('.tmp-'):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                out.append((entry.name, st.st_size, st.st_mtime))
+        return out
+
+    def prune(self):
+        """Remove the least recently used blobs until the store fits in max_bytes."""
+        if not self.max_bytes:
+            return
+
+        blobs = self.list_blobs()
+        total = sum(size for _, size, _ in blobs)
+        if total <= self.max_bytes:
+            return
+
+        start = time.monotonic()
+        removed = 0
+        for digest, size, _ in sorted(blobs, key=lambda x: x[2]):
+            if total <= self.max_bytes:
+                break
+            # Processes that have the file mapped can still use it after unlinking.
+            self.delete(digest)
+            total -= size
+            removed += 1
+        logger.info('Pruned %d blobs in %.1f ms' % (removed, (time.monotonic() - start) * 1000))
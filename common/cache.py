@@ -1,18 +1,91 @@
-import pandas as pd
+import importlib
+import logging
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager, nullcontext
+
+import flask
 from flask_caching import Cache
 
+from common.admission import Doorkeeper
+from common.singleflight import FileLease, RedisLease, single_flight
+
+
+logger = logging.getLogger(__name__)
+
+# Cached values are wrapped in an entry that records when the value
+# was stored and after which point it should be recomputed.
+CacheEntry = namedtuple('CacheEntry', ['value', 'created_at', 'stale_at'])
+# Large values are stored in the blob store and only a reference is
+# kept in the cache backend.
+BlobRef = namedtuple('BlobRef', ['digest', 'size'])
+
+HIT = 'hit'
+STALE = 'stale'
+MISS = 'miss'
+
+# Cache tiers. Values that don't depend on the scenario are pinned in the
+# process memory without a timeout, in front of the shared cache backend.
+PINNED = 'pinned'
+SHARED = 'shared'
 
 _cache_backend = None
+_lease = None
+_codec = None
+_blob_store = None
+_doorkeeper = None
+
+_memo_local = threading.local()
+_admission_local = threading.local()
+
+# Pinned values by pin group, see _get_pin_group()
+_pinned = {}
+_pinned_lock = threading.Lock()
+
+# The epochs of the pin groups are kept in the cache backend, so that
+# delete_group() can unpin a function in every process. Epochs are checked
+# at most every EPOCH_CHECK_INTERVAL seconds, see get_epoch().
+PIN_EPOCHS_KEY = 'pin-epochs'
+EPOCH_CHECK_INTERVAL = 5
+# Epochs by backend key
+_epochs = {}
+
+# Sizes and creation times of the values in Redis are kept in a hash per
+# pin group under this prefix, see _set_entry_info().
+ENTRY_INFO_PREFIX = 'entry-info:'
+
+_stats_lock = threading.Lock()
+_stats = {
+    PINNED: {HIT: 0, MISS: 0},
+    SHARED: {HIT: 0, STALE: 0, MISS: 0},
+    'revalidations': 0,
+    'revalidation_errors': 0,
+    'admitted': 0,
+    'rejected': 0,
+    'missing_blobs': 0,
+}
+
+# Lookup counts by pin group, i.e. by function
+_group_stats = {}
+
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+
+# Keys whose blob was not found in the local blob store. Their values are
+# stored inline on the next set(), see _decode_entry().
+_missing_blobs = set()
+_missing_blobs_lock = threading.Lock()
 
 
 def _init_local_cache():
     from common import settings
     global _cache_backend
 
-    if settings.CACHE_TYPE == 'simple':
-        from flask_caching.backends.simple import SimpleCache
+    if settings.CACHE_TYPE == 'common.lrucache.lru_cache':
+        from common.lrucache import LRUCache
 
-        _cache_backend = SimpleCache()
+        _cache_backend = LRUCache(threshold=settings.CACHE_THRESHOLD)
     elif settings.CACHE_TYPE == 'redis':
         from redis import from_url as redis_from_url
         from flask_caching.backends.rediscache import RedisCache
@@ -21,28 +94,577 @@ def _init_local_cache():
             key_prefix=settings.CACHE_KEY_PREFIX,
             host=redis_from_url(settings.CACHE_REDIS_URL)
         )
+    elif settings.CACHE_TYPE == 'common.diskcache.disk_cache':
+        from common.diskcache import DiskCache
+
+        _cache_backend = DiskCache(settings.CACHE_DIR, max_bytes=settings.CACHE_DIR_MAX_BYTES)
+
+
+def get_codec():
+    from common import settings
+    global _codec
+
+    if _codec is None:
+        _codec = importlib.import_module(settings.CACHE_CODEC)
+    return _codec
+
+
+def _get_blob_store():
+    from common import settings
+    global _blob_store
+
+    if _blob_store is None and settings.CACHE_BLOB_DIR:
+        from common.blobstore import BlobStore
+
+        _blob_store = BlobStore(settings.CACHE_BLOB_DIR, max_bytes=settings.CACHE_BLOB_MAX_BYTES)
+    return _blob_store
+
+
+def _init_lease():
+    from common import settings
+    global _lease
+
+    if _cache_backend is None:
+        _init_local_cache()
+
+    if settings.CACHE_TYPE == 'redis':
+        _lease = RedisLease(_cache_backend._write_client, key_prefix=settings.CACHE_KEY_PREFIX)
+    elif settings.CACHE_TYPE == 'common.lrucache.lru_cache':
+        # Every process has a cache of its own, so a process waiting for
+        # another would not find the result afterwards. Coalesce only the
+        # threads of the process.
+        _lease = False
+    else:
+        _lease = FileLease(settings.CACHE_LOCK_DIR)
+
+
+def _incr_stat(name, tier=None):
+    with _stats_lock:
+        if tier is None:
+            _stats[name] += 1
+        else:
+            _stats[tier][name] += 1
+
+
+def _incr_group_stat(state, key):
+    group = _get_pin_group(key)
+    with _stats_lock:
+        counts = _group_stats.get(group)
+        if counts is None:
+            counts = _group_stats[group] = {HIT: 0, STALE: 0, MISS: 0}
+        counts[state] += 1
+
+
+def get_stats():
+    """Return the lookup counts and the hit ratio of each tier."""
+    with _stats_lock:
+        stats = {
+            name: _stats[name] for name in (
+                'revalidations', 'revalidation_errors', 'admitted', 'rejected', 'missing_blobs',
+            )
+        }
+        for tier in (PINNED, SHARED):
+            counts = dict(_stats[tier])
+            total = sum(counts.values())
+            counts['hit_ratio'] = (total - counts[MISS]) / total if total else None
+            stats[tier] = counts
+    stats['pinned_values'] = len(_pinned)
+    return stats
+
+
+def _get_doorkeeper():
+    from common import settings
+    global _doorkeeper
+
+    if _doorkeeper is None and settings.CACHE_DOORKEEPER_WINDOW:
+        if _cache_backend is None:
+            _init_local_cache()
+        _doorkeeper = Doorkeeper(
+            _cache_backend, window=settings.CACHE_DOORKEEPER_WINDOW, min_age=settings.CACHE_DOORKEEPER_MIN_AGE
+        )
+    return _doorkeeper
+
+
+def should_admit(scenario_hash):
+    """Return True if the values of a scenario are worth storing in the shared tier.
+
+    Values are admitted only when their scenario has been seen in an earlier
+    request, so one-off scenarios don't evict the popular values. The seen
+    scenarios are kept in the cache backend, shared by the processes. The
+    decision is made once per request (or memo scope) and kept in the memo,
+    so all the values of the request get the same decision.
+    """
+    doorkeeper = _get_doorkeeper()
+    if doorkeeper is None or getattr(_admission_local, 'admit_all', False):
+        return True
+
+    memo = get_memo()
+    # Tuple keys can't clash with the cache keys in the memo
+    memo_key = ('admitted', scenario_hash)
+    if memo is not None and memo_key in memo:
+        return memo[memo_key]
+    admitted = doorkeeper.admit(scenario_hash)
+    if memo is not None:
+        admitted = memo.setdefault(memo_key, admitted)
+    _incr_stat('admitted' if admitted else 'rejected')
+    return admitted
+
+
+@contextmanager
+def admit_all():
+    """Bypass the admission checks in the current thread."""
+    old = getattr(_admission_local, 'admit_all', False)
+    _admission_local.admit_all = True
+    try:
+        yield None
+    finally:
+        _admission_local.admit_all = old
+
+
+def _get_pin_group(key):
+    # Keys start with the name of the function, and only the newest value
+    # of each function is kept pinned.
+    return key.split(':', 1)[0]
+
+
+def get_epoch(epochs_key, name):
+    """Return the epoch of `name` in the epochs kept under `epochs_key`.
+
+    The epochs are read from the cache backend at most every
+    EPOCH_CHECK_INTERVAL seconds, so a bump_epoch() in another process is
+    seen within that time.
+    """
+    now = time.monotonic()
+    epochs = _epochs.get(epochs_key)
+    if epochs is None or now - epochs[0] > EPOCH_CHECK_INTERVAL:
+        if _cache_backend is None:
+            _init_local_cache()
+        epochs = _epochs[epochs_key] = (now, _cache_backend.get(epochs_key) or {})
+    return epochs[1].get(name, 0)
+
+
+def bump_epoch(epochs_key, name):
+    """Increment the epoch of `name` in the epochs kept under `epochs_key`.
+
+    With the in-process cache backend, this affects only the current
+    process.
+    """
+    if _cache_backend is None:
+        _init_local_cache()
+
+    with computation_lock(epochs_key):
+        epochs = _cache_backend.get(epochs_key) or {}
+        epochs[name] = epochs.get(name, 0) + 1
+        _cache_backend.set(epochs_key, epochs, timeout=0)
+    _epochs.pop(epochs_key, None)
+
+
+def _get_pin_epoch(group):
+    return get_epoch(PIN_EPOCHS_KEY, group)
+
+
+def _get_pinned(key):
+    group = _get_pin_group(key)
+    pinned = _pinned.get(group)
+    if pinned is None or pinned[0] != key:
+        return None
+    if pinned[2] != _get_pin_epoch(group):
+        # Evicted by delete_group(), possibly in another process
+        with _pinned_lock:
+            if _pinned.get(group) is pinned:
+                del _pinned[group]
+        return None
+    return pinned[1]
+
+
+def _pin(key, val):
+    group = _get_pin_group(key)
+    epoch = _get_pin_epoch(group)
+    with _pinned_lock:
+        _pinned[group] = (key, val, epoch)
+
+
+def unpin_all():
+    with _pinned_lock:
+        _pinned.clear()
+
+
+def get_entry(key):
+    """Return a tuple of (value, state) for `key`.
+
+    State is one of HIT, STALE or MISS. Stale values are past their soft
+    expiry and should be revalidated, but they can still be served.
+    """
+    if _cache_backend is None:
+        _init_local_cache()
 
+    return _decode_entry(key, _cache_backend.get(key))
+
+
+def get_entries(keys):
+    """Like get_entry(), but fetch all the `keys` in one round-trip to the cache backend."""
+    if _cache_backend is None:
+        _init_local_cache()
+
+    return [_decode_entry(key, entry) for key, entry in zip(keys, _cache_backend.get_many(*keys))]
+
+
+def _decode_entry(key, entry):
+    if entry is None:
+        return None, MISS
+    if not isinstance(entry, CacheEntry):
+        # Stored without an entry wrapper, so treat as fresh
+        return entry, HIT
+    data = entry.value
+    if isinstance(data, BlobRef):
+        blob_store = _get_blob_store()
+        data = blob_store.get(data.digest) if blob_store is not None else None
+        if data is None:
+            # The blob was pruned or it was written on another node. Store
+            # the value inline when it's recomputed, so that the nodes
+            # don't keep missing each other's blobs.
+            with _missing_blobs_lock:
+                _missing_blobs.add(key)
+            _incr_stat('missing_blobs')
+            return None, MISS
+
+    val = get_codec().decode(data)
+    if entry.stale_at is not None and time.time() >= entry.stale_at:
+        return val, STALE
+    return val, HIT
+
+
+def lookup(key, tier=SHARED):
+    """Like get_entry(), but also record the hit/stale/miss statistics.
+
+    With the PINNED tier, the pinned values are checked first and a value
+    found in the shared tier is pinned.
+    """
+    if tier == PINNED:
+        val = _get_pinned(key)
+        if val is not None:
+            _incr_stat(HIT, PINNED)
+            _incr_group_stat(HIT, key)
+            return val, HIT
+        _incr_stat(MISS, PINNED)
+
+    val, state = get_entry(key)
+    _incr_stat(state, SHARED)
+    _incr_group_stat(state, key)
+    if tier == PINNED and val is not None:
+        _pin(key, val)
+    return val, state
+
+
+def lookup_many(key_tiers):
+    """Return the fresh values for the keys in `key_tiers`, a dict of tiers by key.
+
+    Pinned values are served from the process memory and the rest are
+    fetched from the shared tier in one round-trip. Only the hits are
+    returned and recorded in the statistics; the missing and stale values
+    are left for lookup().
+    """
+    ret = {}
+    fetch_keys = []
+    for key, tier in key_tiers.items():
+        val = _get_pinned(key) if tier == PINNED else None
+        if val is not None:
+            _incr_stat(HIT, PINNED)
+            _incr_group_stat(HIT, key)
+            ret[key] = val
+        else:
+            fetch_keys.append(key)
+
+    if not fetch_keys:
+        return ret
+
+    for key, (val, state) in zip(fetch_keys, get_entries(fetch_keys)):
+        if state != HIT:
+            continue
+        if key_tiers[key] == PINNED:
+            _incr_stat(MISS, PINNED)
+            _pin(key, val)
+        _incr_stat(HIT, SHARED)
+        _incr_group_stat(HIT, key)
+        ret[key] = val
+    return ret
+
+
+def _set_entry_info(key, size, created_at):
+    from common import settings
+
+    if settings.CACHE_TYPE == 'redis':
+        info_key = _cache_backend._get_prefix() + ENTRY_INFO_PREFIX + _get_pin_group(key)
+        _cache_backend._write_client.hset(info_key, key, '%d %f' % (size, created_at))
+    else:
+        _cache_backend.set_info(key, (size, created_at))
+
+
+def _iter_redis_entry_info():
+    client = _cache_backend._write_client
+    prefix = _cache_backend._get_prefix()
+    for info_key in client.scan_iter(match=prefix + ENTRY_INFO_PREFIX + '*', count=1000):
+        infos = [(key.decode('utf8'), info.decode('utf8')) for key, info in client.hgetall(info_key).items()]
+        # The values might have been evicted or expired since
+        pipe = client.pipeline()
+        for key, _ in infos:
+            pipe.exists(prefix + key)
+        missing = []
+        for (key, info), exists in zip(infos, pipe.execute()):
+            if not exists:
+                missing.append(key)
+                continue
+            size, created_at = info.split(' ')
+            yield key, int(size), float(created_at)
+        if missing:
+            client.hdel(info_key, *missing)
+
+
+def iter_entries():
+    """Yield a (key, size, created_at) tuple for every value in the shared tier.
+
+    The size is that of the serialized value, including the blob if the
+    value is in the blob store. The sizes and creation times are recorded
+    on set(), so the values themselves are not read.
+    """
+    from common import settings
+
+    if _cache_backend is None:
+        _init_local_cache()
+
+    if settings.CACHE_TYPE == 'redis':
+        yield from _iter_redis_entry_info()
+    else:
+        for key, (size, created_at) in _cache_backend.iter_info():
+            yield key, size, created_at
+
+
+def get_group_stats():
+    """Return the cached values and the lookup counts of this process by function."""
+    now = time.time()
+    groups = {}
+
+    def get_group(name):
+        group = groups.get(name)
+        if group is None:
+            group = groups[name] = dict(
+                count=0, bytes=0, oldest_age=None, newest_age=None, pinned=False, hit=0, stale=0, miss=0,
+            )
+        return group
+
+    for key, size, created_at in iter_entries():
+        group = get_group(_get_pin_group(key))
+        age = now - created_at
+        group['count'] += 1
+        group['bytes'] += size
+        group['oldest_age'] = max(age, group['oldest_age'] or 0)
+        group['newest_age'] = min(age, group['newest_age'] if group['newest_age'] is not None else age)
+
+    with _pinned_lock:
+        pinned_groups = list(_pinned.keys())
+    for name in pinned_groups:
+        get_group(name)['pinned'] = True
+
+    with _stats_lock:
+        for name, counts in _group_stats.items():
+            get_group(name).update(counts)
+
+    return groups
+
+
+def delete_group(name):
+    """Remove all the cached values of a function.
+
+    The values are removed from the shared tier, and the pinned values are
+    dropped by every process within EPOCH_CHECK_INTERVAL seconds. With
+    the in-process cache backend, this affects only the current process.
+    Returns the number of values removed from the shared tier.
+    """
+    from common import settings
 
-def get(key):
     if _cache_backend is None:
         _init_local_cache()
 
-    return _cache_backend.get(key)
+    bump_epoch(PIN_EPOCHS_KEY, name)
+    with _pinned_lock:
+        _pinned.pop(name, None)
+
+    keys = [key for key, _, _ in iter_entries() if _get_pin_group(key) == name]
+    if keys:
+        _cache_backend.delete_many(*keys)
+    if settings.CACHE_TYPE == 'redis':
+        _cache_backend._write_client.delete(_cache_backend._get_prefix() + ENTRY_INFO_PREFIX + name)
+    return len(keys)
+
+
+def get(key, tier=SHARED):
+    if tier == PINNED:
+        val = _get_pinned(key)
+        if val is not None:
+            return val
+    return get_entry(key)[0]
 
 
-def set(key, val, timeout=None):
+def set(key, val, timeout=None, soft_timeout=None, tier=SHARED, admission_key=None):
+    """Store `val` in the cache.
+
+    After `soft_timeout` seconds the value is considered stale and after
+    `timeout` seconds it is removed from the cache altogether. With the
+    PINNED tier, the value is also pinned in the process memory, and the
+    caller must not modify it afterwards.
+
+    If `admission_key`, the hash of the scenario, is given and should_admit()
+    doesn't allow it, the value is kept for only CACHE_REJECTED_TIMEOUT
+    seconds, long enough for the callers waiting on computation_lock() to
+    pick it up. Returns True if the value was admitted.
+    """
+    from common import settings
+
+    admitted = True
+    if tier == PINNED:
+        _pin(key, val)
+    elif admission_key is not None:
+        admitted = should_admit(admission_key)
+
     if _cache_backend is None:
         _init_local_cache()
 
-    _cache_backend.set(key, val)
+    if not admitted:
+        timeout = settings.CACHE_REJECTED_TIMEOUT
+        soft_timeout = 0
+    if timeout is None:
+        timeout = settings.CACHE_HARD_TIMEOUT
+    if soft_timeout is None:
+        soft_timeout = settings.CACHE_SOFT_TIMEOUT
+
+    now = time.time()
+    stale_at = now + soft_timeout if soft_timeout else None
+    codec = get_codec()
+    data = codec.encode(val, allow_compression=False)
+    blob_store = _get_blob_store()
+    with _missing_blobs_lock:
+        store_inline = key in _missing_blobs
+        _missing_blobs.discard(key)
+    if blob_store is not None and not store_inline and len(data) > settings.CACHE_BLOB_THRESHOLD:
+        data = BlobRef(blob_store.put(data), len(data))
+        size = data.size
+    else:
+        data = codec.compress(data)
+        size = len(data)
+    _cache_backend.set(key, CacheEntry(data, now, stale_at), timeout=timeout)
+    _set_entry_info(key, size, now)
+    return admitted
+
+
+def _revalidate(key, compute, tier, context):
+    try:
+        with context() if context is not None else nullcontext():
+            with computation_lock(key):
+                # Somebody else might have refreshed the value while we were waiting
+                val, state = get_entry(key)
+                if state == HIT:
+                    if tier == PINNED:
+                        _pin(key, val)
+                    return
+                val = compute()
+                assert val is not None
+                set(key, val, tier=tier)
+        _incr_stat('revalidations')
+    except Exception:
+        _incr_stat('revalidation_errors')
+        logger.exception('Revalidating cache key %s failed' % key)
+    finally:
+        with _revalidating_lock:
+            _revalidating.discard(key)
+
+
+def revalidate(key, compute, tier=SHARED, context=None):
+    """Recompute a stale value in a background thread.
+
+    `compute` is called without arguments and must return the new value.
+    If `context` is given, it's called in the background thread to get a
+    context manager that is entered before the computation lock is taken,
+    e.g. to compute the dependencies of the value. Only one revalidation
+    per key is run at a time.
+    """
+    with _revalidating_lock:
+        if key in _revalidating:
+            return
+        _revalidating.add(key)
+
+    thread = threading.Thread(target=_revalidate, args=(key, compute, tier, context), daemon=True)
+    thread.start()
+
+
+@contextmanager
+def computation_lock(key):
+    """Coalesce concurrent computations of the value for `key`.
+
+    Callers should check the cache again after acquiring the lock.
+    """
+    if _lease is None:
+        _init_lease()
+
+    with single_flight(key, _lease or None):
+        yield None
+
+
+def get_memo():
+    if flask.has_request_context():
+        memo = getattr(flask.g, '_cache_memo', None)
+        if memo is None:
+            memo = flask.g._cache_memo = {}
+        return memo
+
+    return getattr(_memo_local, 'memo', None)
+
+
+@contextmanager
+def memo_scope(memo=None):
+    """Memoize cached values also outside of a request context.
+
+    Inside a request the memo lives in `flask.g` and is dropped when the
+    request ends. If `memo` is given, it's used as the memo of the current
+    thread, e.g. to share the memo of a request with worker threads.
+    """
+    old = getattr(_memo_local, 'memo', None)
+    if memo is not None:
+        _memo_local.memo = memo
+    elif old is None:
+        _memo_local.memo = {}
+    try:
+        yield None
+    finally:
+        _memo_local.memo = old
+
+
+def memo_get(key):
+    """Return a value memoized during the current request (or memo scope).
+
+    The same object is handed out to every caller, so it must be treated as
+    read-only; callers that modify the result should copy it first.
+    """
+    memo = get_memo()
+    if memo is None:
+        return None
+    return memo.get(key)
+
+
+def memo_set(key, val):
+    """Memoize `val` and return it."""
+    memo = get_memo()
+    if memo is not None:
+        memo[key] = val
+    return val
 
 
 def init_app(app):
-    global memoize, get, set
+    global memoize, _cache_backend, _lease, _doorkeeper
 
     _cache = Cache()
     _cache.init_app(app)
 
     memoize = _cache.memoize
-    get = _cache.get
-    set = _cache.set
+    _cache_backend = app.extensions['cache'][_cache]
+    _lease = None
+    _doorkeeper = None
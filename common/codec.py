@@ -0,0 +1,139 @@
+import json
+import logging
+import pickle
+
+import pandas as pd
+import pyarrow as pa
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+
+logger = logging.getLogger(__name__)
+
+# Encoded values larger than this (in bytes) are compressed
+COMPRESS_THRESHOLD = 256 * 1024
+
+PICKLE = b'P'
+ARROW = b'A'
+TUPLE = b'T'
+SNAPPY = b'S'
+
+_METADATA_KEY = b'ghgdash'
+
+
+def _is_arrow_compatible(df):
+    # Arrow would convert object columns holding e.g. booleans or mixed
+    # types into a different dtype, so only strings are allowed.
+    columns = [df.iloc[:, i] for i, dtype in enumerate(df.dtypes) if dtype == object]
+    index = df.index
+    levels = [index.get_level_values(i) for i in range(index.nlevels)]
+    columns += [level for level in levels if level.dtype == object]
+    for col in columns:
+        if pd.api.types.infer_dtype(col, skipna=True) not in ('string', 'empty'):
+            return False
+    return True
+
+
+def _encode_arrow(val):
+    meta = {}
+    if isinstance(val, pd.Series):
+        meta['kind'] = 'series'
+        df = val.to_frame(name=val.name if val.name is not None else '__series__')
+        meta['has_name'] = val.name is not None
+    else:
+        meta['kind'] = 'frame'
+        df = val
+
+    if not df.columns.is_unique or not _is_arrow_compatible(df):
+        return None
+
+    # Frequency of a DatetimeIndex is not preserved by Arrow
+    freq = getattr(df.index, 'freqstr', None)
+    if freq is not None:
+        meta['index_freq'] = freq
+
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    metadata = dict(table.schema.metadata or {})
+    metadata[_METADATA_KEY] = json.dumps(meta).encode('utf8')
+    table = table.replace_schema_metadata(metadata)
+
+    sink = pa.BufferOutputStream()
+    writer = pa.ipc.new_stream(sink, table.schema)
+    writer.write_table(table)
+    writer.close()
+    return sink.getvalue()
+
+
+def _decode_arrow(buf):
+    table = pa.ipc.open_stream(buf).read_all()
+    meta = json.loads(table.schema.metadata[_METADATA_KEY].decode('utf8'))
+    # With split_blocks, numeric columns without nulls are not copied
+    df = table.to_pandas(split_blocks=True)
+
+    freq = meta.get('index_freq')
+    if freq is not None:
+        df.index.freq = freq
+
+    if meta['kind'] == 'series':
+        s = df.iloc[:, 0]
+        if not meta['has_name']:
+            s.name = None
+        return s
+    return df
+
+
+def _encode(val):
+    if isinstance(val, tuple):
+        parts = [bytes(_encode(x)) for x in val]
+        return TUPLE + pickle.dumps(parts, protocol=pickle.HIGHEST_PROTOCOL)
+
+    if isinstance(val, (pd.DataFrame, pd.Series)):
+        try:
+            buf = _encode_arrow(val)
+        except (pa.ArrowException, TypeError, ValueError) as e:
+            logger.debug('Falling back to pickle: %s' % e)
+            buf = None
+        if buf is not None:
+            return ARROW + buf.to_pybytes()
+
+    return PICKLE + pickle.dumps(val, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def compress(data):
+    if snappy is not None and len(data) > COMPRESS_THRESHOLD:
+        data = SNAPPY + snappy.compress(data)
+    return data
+
+
+def encode(val, allow_compression=True):
+    """Serialize a cached value into bytes.
+
+    Pandas objects are stored as Arrow IPC streams, other values are
+    pickled. Large payloads are compressed with snappy if it's available,
+    unless `allow_compression` is False (e.g. because the data will be
+    memory-mapped).
+    """
+    data = _encode(val)
+    if allow_compression:
+        data = compress(data)
+    return data
+
+
+def decode(data):
+    data = memoryview(data)
+    kind = bytes(data[:1])
+    if kind == SNAPPY:
+        data = memoryview(snappy.decompress(data[1:]))
+        kind = bytes(data[:1])
+
+    if kind == ARROW:
+        return _decode_arrow(pa.py_buffer(data[1:]))
+    if kind == TUPLE:
+        return tuple(decode(x) for x in pickle.loads(data[1:]))
+    if kind == PICKLE:
+        return pickle.loads(data[1:])
+
+    raise ValueError('Unknown encoding: %s' % kind)
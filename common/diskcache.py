@@ -0,0 +1,256 @@
+import logging
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+import pyarrow as pa
+from flask_caching.backends.base import BaseCache
+
+
+logger = logging.getLogger(__name__)
+
+# Check the total size of the cache after this many writes
+PRUNE_INTERVAL = 20
+# How long (in seconds) to wait for another process to release the index
+SQLITE_TIMEOUT = 30
+# The access time of an entry is updated at most this often (in seconds),
+# so that reads don't turn into writes to the index every time.
+ACCESS_UPDATE_INTERVAL = 60
+# SQLite limits the number of parameters in a query
+MAX_QUERY_KEYS = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires REAL,
+    accessed REAL NOT NULL,
+    info BLOB
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+'''
+
+
+class DiskCache(BaseCache):
+    """Cache backend that stores the values in files indexed in SQLite.
+
+    Meant for single-node deployments without Redis: all the worker
+    processes on the node share the cache, and it survives restarts. The
+    values are pickled into files that are memory-mapped when read, and the
+    least recently used entries are evicted when the total size of the
+    values exceeds `max_bytes`.
+    """
+
+    def __init__(self, cache_dir, max_bytes=None, default_timeout=300):
+        super().__init__(default_timeout)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(cache_dir, 'values'), exist_ok=True)
+        self._get_conn().executescript(SCHEMA)
+
+    def _get_conn(self):
+        # SQLite connections can't be shared between threads, nor used in
+        # a process forked after they were opened.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(
+                os.path.join(self.cache_dir, 'index.sqlite'), timeout=SQLITE_TIMEOUT, isolation_level=None
+            )
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _get_path(self, file_name):
+        return os.path.join(self.cache_dir, 'values', file_name[:2], file_name)
+
+    def _delete_files(self, file_names):
+        # Processes that have the file mapped can still use it after unlinking.
+        for file_name in file_names:
+            try:
+                os.unlink(self._get_path(file_name))
+            except FileNotFoundError:
+                pass
+
+    def _read(self, key, file_name, accessed, now):
+        try:
+            mm = pa.memory_map(self._get_path(file_name), 'r')
+        except OSError:
+            # Replaced or evicted by another process after we read the index
+            return None
+        try:
+            value = pickle.loads(mm.read_buffer())
+        except Exception:
+            logger.exception('Unable to read cache value for %s' % key)
+            return None
+        if now - accessed > ACCESS_UPDATE_INTERVAL:
+            self._get_conn().execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+        return value
+
+    def get(self, key):
+        now = time.time()
+        row = self._get_conn().execute(
+            'SELECT file, expires, accessed FROM entries WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        file_name, expires, accessed = row
+        if expires is not None and expires <= now:
+            return None
+        return self._read(key, file_name, accessed, now)
+
+    def get_many(self, *keys):
+        now = time.time()
+        conn = self._get_conn()
+        rows = {}
+        for i in range(0, len(keys), MAX_QUERY_KEYS):
+            chunk = keys[i:i + MAX_QUERY_KEYS]
+            query = 'SELECT key, file, expires, accessed FROM entries WHERE key IN (%s)' % ','.join('?' * len(chunk))
+            for key, file_name, expires, accessed in conn.execute(query, chunk):
+                if expires is None or expires > now:
+                    rows[key] = (file_name, accessed)
+
+        out = []
+        for key in keys:
+            row = rows.get(key)
+            out.append(self._read(key, row[0], row[1], now) if row is not None else None)
+        return out
+
+    def set_info(self, key, info):
+        """Attach `info` to the entry for `key` in the index until the entry is replaced."""
+        data = pickle.dumps(info, pickle.HIGHEST_PROTOCOL)
+        self._get_conn().execute('UPDATE entries SET info = ? WHERE key = ?', (data, key))
+
+    def iter_info(self):
+        """Yield a (key, info) tuple for every unexpired entry with info.
+
+        Only the index is read, not the values.
+        """
+        rows = self._get_conn().execute(
+            'SELECT key, info FROM entries WHERE info IS NOT NULL AND (expires IS NULL OR expires > ?)',
+            (time.time(),)
+        ).fetchall()
+        for key, data in rows:
+            yield key, pickle.loads(data)
+
+    def has(self, key):
+        row = self._get_conn().execute('SELECT expires FROM entries WHERE key = ?', (key,)).fetchone()
+        return row is not None and (row[0] is None or row[0] > time.time())
+
+    def _store(self, key, value, timeout, overwrite):
+        timeout = self._normalize_timeout(timeout)
+        now = time.time()
+        expires = now + timeout if timeout else None
+
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        # Every write gets a new file, so readers never see a half-written value
+        file_name = uuid.uuid4().hex
+        path = self._get_path(file_name)
+        dir_path = os.path.dirname(path)
+        os.makedirs(dir_path, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+        conn = self._get_conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT file, expires FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is not None and not overwrite and (row[1] is None or row[1] > now):
+                conn.execute('ROLLBACK')
+                self._delete_files([file_name])
+                return False
+            conn.execute(
+                'INSERT OR REPLACE INTO entries (key, file, size, expires, accessed) VALUES (?, ?, ?, ?, ?)',
+                (key, file_name, len(data), expires, now)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            self._delete_files([file_name])
+            raise
+        if row is not None:
+            self._delete_files([row[0]])
+
+        with self._lock:
+            self._writes += 1
+            should_prune = self._writes % PRUNE_INTERVAL == 0
+        if should_prune:
+            self.prune()
+        return True
+
+    def set(self, key, value, timeout=None):
+        return self._store(key, value, timeout, overwrite=True)
+
+    def add(self, key, value, timeout=None):
+        return self._store(key, value, timeout, overwrite=False)
+
+    def delete(self, key):
+        conn = self._get_conn()
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('SELECT file FROM entries WHERE key = ?', (key,)).fetchone()
+        conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+        conn.execute('COMMIT')
+        if row is None:
+            return False
+        self._delete_files([row[0]])
+        return True
+
+    def clear(self):
+        conn = self._get_conn()
+        conn.execute('BEGIN IMMEDIATE')
+        file_names = [row[0] for row in conn.execute('SELECT file FROM entries')]
+        conn.execute('DELETE FROM entries')
+        conn.execute('COMMIT')
+        self._delete_files(file_names)
+        return True
+
+    def prune(self):
+        """Remove the expired entries and then the least recently used ones until the cache fits in max_bytes."""
+        start = time.monotonic()
+        conn = self._get_conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            removed = [
+                row[0] for row in conn.execute('SELECT file FROM entries WHERE expires <= ?', (time.time(),))
+            ]
+            conn.execute('DELETE FROM entries WHERE expires <= ?', (time.time(),))
+
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if self.max_bytes and total > self.max_bytes:
+                evicted = []
+                for key, file_name, size in conn.execute('SELECT key, file, size FROM entries ORDER BY accessed'):
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append((key, file_name))
+                    total -= size
+                conn.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key, _ in evicted])
+                removed += [file_name for _, file_name in evicted]
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        self._delete_files(removed)
+        if removed:
+            logger.info('Pruned %d cache entries in %.1f ms' % (len(removed), (time.monotonic() - start) * 1000))
+
+
+def disk_cache(app, config, args, kwargs):
+    """Flask-Caching backend factory, used with CACHE_TYPE = 'common.diskcache.disk_cache'."""
+    kwargs.update(dict(max_bytes=config.get('CACHE_DIR_MAX_BYTES')))
+    return DiskCache(config['CACHE_DIR'], *args, **kwargs)
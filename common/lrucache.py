@@ -0,0 +1,106 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from flask_caching.backends.base import BaseCache
+
+
+class LRUCache(BaseCache):
+    """In-process cache backend that evicts the least recently used values.
+
+    Like Flask-Caching's SimpleCache, the values are pickled so that callers
+    can't modify the cached copies, but when there are more than
+    `threshold` values, the ones that have gone unread the longest are
+    dropped first. SimpleCache instead drops every third value in insertion
+    order, which can evict the hottest values.
+    """
+
+    def __init__(self, threshold=500, default_timeout=300):
+        super().__init__(default_timeout)
+        self.threshold = threshold
+        # Entries of (expires, pickled value) in the order of use
+        self._cache = OrderedDict()
+        # Information on the entries given to set_info()
+        self._info = {}
+        self._lock = threading.Lock()
+
+    def _normalize_timeout(self, timeout):
+        timeout = super()._normalize_timeout(timeout)
+        return time.time() + timeout if timeout else 0
+
+    def _get_entry(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires = entry[0]
+        if expires and expires <= time.time():
+            del self._cache[key]
+            self._info.pop(key, None)
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._get_entry(key)
+            if entry is None:
+                return None
+            self._cache.move_to_end(key)
+        return pickle.loads(entry[1])
+
+    def set_info(self, key, info):
+        """Attach `info` to the entry for `key` until the entry is removed."""
+        with self._lock:
+            if key in self._cache:
+                self._info[key] = info
+
+    def iter_info(self):
+        """Yield a (key, info) tuple for every unexpired entry with info."""
+        now = time.time()
+        with self._lock:
+            items = [
+                (key, info) for key, info in self._info.items()
+                if not self._cache[key][0] or self._cache[key][0] > now
+            ]
+        yield from items
+
+    def has(self, key):
+        with self._lock:
+            return self._get_entry(key) is not None
+
+    def _store(self, key, value, timeout, overwrite):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        expires = self._normalize_timeout(timeout)
+        with self._lock:
+            if not overwrite and self._get_entry(key) is not None:
+                return False
+            self._cache[key] = (expires, data)
+            self._cache.move_to_end(key)
+            self._info.pop(key, None)
+            while len(self._cache) > self.threshold:
+                evicted_key, _ = self._cache.popitem(last=False)
+                self._info.pop(evicted_key, None)
+        return True
+
+    def set(self, key, value, timeout=None):
+        return self._store(key, value, timeout, overwrite=True)
+
+    def add(self, key, value, timeout=None):
+        return self._store(key, value, timeout, overwrite=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._info.pop(key, None)
+            return self._cache.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._info.clear()
+        return True
+
+
+def lru_cache(app, config, args, kwargs):
+    """Flask-Caching backend factory, used with CACHE_TYPE = 'common.lrucache.lru_cache'."""
+    kwargs.update(dict(threshold=config['CACHE_THRESHOLD']))
+    return LRUCache(*args, **kwargs)
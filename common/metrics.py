@@ -0,0 +1,78 @@
+import os
+
+import flask
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+)
+
+
+# Where the result of a calcfunc call came from
+UNCACHED = 'uncached'
+MEMO = 'memo'
+PREFETCH = 'prefetch'
+HIT = 'hit'
+STALE = 'stale'
+SNAPSHOT = 'snapshot'
+COALESCED = 'coalesced'
+MISS = 'miss'
+
+CALLS = Counter('calcfunc_calls_total', 'Calls of calcfuncs', ['function'])
+RESULTS = Counter(
+    'calcfunc_results_total', 'Calls of calcfuncs by where the result came from', ['function', 'source']
+)
+COMPUTE_TIME = Histogram(
+    'calcfunc_compute_seconds', 'Time spent computing calcfunc results, including the calcfuncs called',
+    ['function'], buckets=(.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60),
+)
+KEYGEN_TIME = Histogram(
+    'calcfunc_cache_key_seconds', 'Time spent generating calcfunc cache keys, including argument hashing',
+    ['function'], buckets=(.0001, .00025, .0005, .001, .0025, .005, .01, .025, .1),
+)
+DATASET_LOAD_TIME = Histogram(
+    'dataset_load_seconds', 'Time spent loading datasets', ['dataset'],
+    buckets=(.01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30),
+)
+
+
+class CalcFuncMetrics:
+    """The metrics of one calcfunc.
+
+    The labelled metrics are looked up once, so recording a call is only
+    a few increments.
+    """
+
+    def __init__(self, func_name):
+        self.func_name = func_name
+        self.calls = CALLS.labels(func_name)
+        self.compute_time = COMPUTE_TIME.labels(func_name)
+        self.keygen_time = KEYGEN_TIME.labels(func_name)
+        self._results = {}
+
+    def record_result(self, source):
+        counter = self._results.get(source)
+        if counter is None:
+            counter = self._results[source] = RESULTS.labels(self.func_name, source)
+        counter.inc()
+
+
+def observe_dataset_load(path, seconds):
+    DATASET_LOAD_TIME.labels(path).observe(seconds)
+
+
+def _get_registry():
+    # With several worker processes, prometheus_client keeps the values in
+    # files in the directory given in the environment (set up in
+    # gunicorn.conf.py), and they are aggregated here.
+    if 'prometheus_multiproc_dir' not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics_view():
+    return flask.Response(generate_latest(_get_registry()), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    app.add_url_rule('/metrics', 'metrics', view_func=metrics_view)
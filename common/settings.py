@@ -10,8 +10,88 @@ load_dotenv()
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 
 CACHE_KEY_PREFIX = 'ghgdash-cache'
-CACHE_TYPE = 'simple'
+CACHE_TYPE = 'common.lrucache.lru_cache'
 CACHE_REDIS_URL = None
+CACHE_LOCK_DIR = os.path.join(BASE_DIR, 'cache-locks')
+# Without Redis, setting CACHE_DIR stores the cache on disk, shared by all
+# the processes on the node. The least recently used values are evicted
+# when they take more than CACHE_DIR_MAX_BYTES.
+CACHE_DIR = os.getenv('CACHE_DIR', None)
+CACHE_DIR_MAX_BYTES = int(os.getenv('CACHE_DIR_MAX_BYTES', 1024 * 1024 * 1024))
+# Maximum number of entries in the in-process LRU cache used without Redis
+# or CACHE_DIR. With Redis, bound the memory with maxmemory and
+# maxmemory-policy allkeys-lru instead.
+CACHE_THRESHOLD = int(os.getenv('CACHE_THRESHOLD', 500))
+# Results of non-default scenarios are cached only after the scenario has
+# been seen at least CACHE_DOORKEEPER_MIN_AGE seconds earlier. Scenarios are
+# remembered for CACHE_DOORKEEPER_WINDOW seconds; 0 admits everything. The
+# results of the scenarios not yet admitted are kept for only
+# CACHE_REJECTED_TIMEOUT seconds, so that the concurrent callers waiting for
+# the computation still find them.
+CACHE_DOORKEEPER_WINDOW = int(os.getenv('CACHE_DOORKEEPER_WINDOW', 24 * 60 * 60))
+CACHE_DOORKEEPER_MIN_AGE = int(os.getenv('CACHE_DOORKEEPER_MIN_AGE', 60))
+CACHE_REJECTED_TIMEOUT = int(os.getenv('CACHE_REJECTED_TIMEOUT', 60))
+# Cached values older than CACHE_SOFT_TIMEOUT seconds are still served, but
+# they are recomputed in the background. After CACHE_HARD_TIMEOUT seconds
+# they are dropped from the cache. 0 disables the timeout.
+#
+# The cache keys change with the code, the file dependencies and the dataset
+# versions, so by default the values never expire and eviction is left to
+# the cache backend (e.g. Redis with maxmemory-policy allkeys-lru).
+CACHE_SOFT_TIMEOUT = int(os.getenv('CACHE_SOFT_TIMEOUT', 0))
+CACHE_HARD_TIMEOUT = int(os.getenv('CACHE_HARD_TIMEOUT', 0))
+# Module with encode(), compress() and decode() functions for serializing
+# cached values
+CACHE_CODEC = 'common.codec'
+# If CACHE_BLOB_DIR is set, values larger than CACHE_BLOB_THRESHOLD bytes are
+# stored as memory-mapped files in it and only a reference to them goes to
+# the cache. The files are local to the node, so with several nodes sharing
+# Redis, the values written by the other nodes are stored again inline.
+CACHE_BLOB_DIR = os.getenv('CACHE_BLOB_DIR', None)
+CACHE_BLOB_THRESHOLD = int(os.getenv('CACHE_BLOB_THRESHOLD', 1024 * 1024))
+CACHE_BLOB_MAX_BYTES = int(os.getenv('CACHE_BLOB_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+# Results of the default scenario computed by scripts/build_default_snapshot.py
+DEFAULT_SNAPSHOT_DIR = os.getenv('DEFAULT_SNAPSHOT_DIR', os.path.join(BASE_DIR, 'default-snapshot'))
+
+# Maximum memory used by the loaded datasets (in bytes). Least recently
+# used datasets are evicted when it's exceeded. 0 means no limit.
+DATASET_CACHE_MAX_BYTES = int(os.getenv('DATASET_CACHE_MAX_BYTES', 0))
+# Class that stores the datasets. Use utils.local_datasets.LocalArrowBackend
+# to read them from the Arrow files in DATASET_DIR (see
+# scripts/import_quilt_datasets.py).
+DATASET_BACKEND = os.getenv('DATASET_BACKEND', 'utils.quilt.QuiltBackend')
+DATASET_DIR = os.getenv('DATASET_DIR', os.path.join(BASE_DIR, 'datasets'))
+# How often (in seconds) to check the dataset backend for new versions of
+# the datasets in use. 0 disables the checks.
+DATASET_REFRESH_INTERVAL = int(os.getenv('DATASET_REFRESH_INTERVAL', 0))
+# Load all the datasets at startup instead of on first use. Every worker
+# process then holds every declared dataset in memory, so turn this off on
+# small instances.
+PRELOAD_DATASETS = os.getenv('PRELOAD_DATASETS', '1').lower() in ('1', 'true', 'yes')
+
+# On a cache miss, compute the dependencies of a calcfunc concurrently using
+# this many threads (or processes with CALC_PARALLEL_PROCESSES). 0 computes
+# them sequentially.
+CALC_PARALLEL_WORKERS = int(os.getenv('CALC_PARALLEL_WORKERS', 0))
+CALC_PARALLEL_PROCESSES = os.getenv('CALC_PARALLEL_PROCESSES', '').lower() in ('1', 'true', 'yes')
+
+# Calls of calcfuncs with arguments are cached by hashing the arguments.
+# DataFrames larger than this many bytes are not hashed, and the call is
+# not cached.
+CALC_ARG_HASH_MAX_BYTES = int(os.getenv('CALC_ARG_HASH_MAX_BYTES', 64 * 1024 * 1024))
+
+# Recompute the results of the WARMER_TOP_SCENARIOS most popular scenarios
+# every WARMER_INTERVAL seconds using at most WARMER_CPU_BUDGET of a CPU.
+# 0 disables the warmer.
+WARMER_TOP_SCENARIOS = int(os.getenv('WARMER_TOP_SCENARIOS', 0))
+WARMER_INTERVAL = int(os.getenv('WARMER_INTERVAL', 300))
+WARMER_CPU_BUDGET = float(os.getenv('WARMER_CPU_BUDGET', 0.1))
+if not 0 < WARMER_CPU_BUDGET <= 1:
+    raise ImproperlyConfigured('WARMER_CPU_BUDGET must be more than 0 and at most 1')
+
+# Bearer token for the cache introspection endpoints under /admin/. The
+# endpoints are not registered if it's not set.
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', None)
 
 SESSION_TYPE = 'filesystem'
 SESSION_FILE_DIR = os.path.join(BASE_DIR, 'flask_session')
@@ -30,6 +110,8 @@ def get_cache_config():
     if url:
         CACHE_REDIS_URL = url
         CACHE_TYPE = 'redis'
+    elif CACHE_DIR:
+        CACHE_TYPE = 'common.diskcache.disk_cache'
 
 
 get_cache_config()
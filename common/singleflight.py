@@ -0,0 +1,137 @@
+import fcntl
+import hashlib
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+# How long (in seconds) a computation lease is held at most. If the process
+# computing the value dies, the others will continue after this.
+LEASE_TIMEOUT = 120
+POLL_INTERVAL = 0.05
+
+_local_locks = {}
+_local_locks_lock = threading.Lock()
+
+
+@contextmanager
+def _local_lock(key):
+    with _local_locks_lock:
+        entry = _local_locks.get(key)
+        if entry is None:
+            entry = _local_locks[key] = [threading.Lock(), 0]
+        entry[1] += 1
+
+    lock = entry[0]
+    lock.acquire()
+    try:
+        yield None
+    finally:
+        lock.release()
+        with _local_locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _local_locks[key]
+
+
+class RedisLease:
+    """Computation lease shared by all processes using the same Redis."""
+
+    # Delete the lease only if it's still ours
+    RELEASE_SCRIPT = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, client, key_prefix=''):
+        self.client = client
+        self.key_prefix = key_prefix
+        self._release = client.register_script(self.RELEASE_SCRIPT)
+
+    def _make_key(self, key):
+        return '%slease:%s' % (self.key_prefix, key)
+
+    def acquire(self, key, timeout):
+        lease_key = self._make_key(key)
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.client.set(lease_key, token, nx=True, px=int(timeout * 1000)):
+                return token
+            if time.monotonic() > deadline:
+                return None
+            time.sleep(POLL_INTERVAL)
+
+    def release(self, key, token):
+        self._release(keys=[self._make_key(key)], args=[token])
+
+
+class FileLease:
+    """Computation lease shared by the processes on the same node."""
+
+    def __init__(self, lock_dir):
+        self.lock_dir = lock_dir
+        os.makedirs(lock_dir, exist_ok=True)
+
+    def _try_lock(self, fn):
+        fd = os.open(fn, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+
+        # The lock files are removed on release, so make sure the file we
+        # locked wasn't unlinked by the previous holder in the meantime.
+        try:
+            is_current = os.fstat(fd).st_ino == os.stat(fn).st_ino
+        except FileNotFoundError:
+            is_current = False
+        if not is_current:
+            os.close(fd)
+            return None
+
+        return fd
+
+    def acquire(self, key, timeout):
+        fn = os.path.join(self.lock_dir, hashlib.md5(key.encode('utf8')).hexdigest())
+        deadline = time.monotonic() + timeout
+        while True:
+            fd = self._try_lock(fn)
+            if fd is not None:
+                return (fn, fd)
+            if time.monotonic() > deadline:
+                return None
+            time.sleep(POLL_INTERVAL)
+
+    def release(self, key, handle):
+        fn, fd = handle
+        try:
+            os.unlink(fn)
+        except FileNotFoundError:
+            pass
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+@contextmanager
+def single_flight(key, lease=None, timeout=LEASE_TIMEOUT):
+    """Allow only one computation for `key` at a time.
+
+    Threads within the process wait on a local lock and, if `lease` is given,
+    processes wait on the shared lease. If the lease can't be acquired within
+    `timeout` seconds, the caller proceeds anyway.
+    """
+    with _local_lock(key):
+        handle = None
+        if lease is not None:
+            handle = lease.acquire(key, timeout)
+        try:
+            yield None
+        finally:
+            if handle is not None:
+                lease.release(key, handle)
@@ -0,0 +1,50 @@
+import hashlib
+import os
+import shutil
+
+import pyarrow as pa
+
+
+def _get_file_name(key):
+    return hashlib.md5(key.encode('utf8')).hexdigest()
+
+
+class SnapshotReader:
+    """Read-only set of precomputed cache values.
+
+    Each value is a file encoded with the cache codec. The files are
+    memory-mapped when read, so the processes on the node share the pages.
+    """
+
+    def __init__(self, path, codec):
+        self.path = path
+        self.codec = codec
+
+    def get(self, key):
+        try:
+            mm = pa.memory_map(os.path.join(self.path, _get_file_name(key)), 'r')
+        except OSError:
+            return None
+        return self.codec.decode(mm.read_buffer())
+
+
+class SnapshotWriter:
+    """Write a snapshot to `path`, replacing the old one on commit()."""
+
+    def __init__(self, path, codec):
+        self.path = path
+        self.codec = codec
+        self.tmp_path = path + '.tmp'
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+
+    def put(self, key, val):
+        # Uncompressed, so that the values can be memory-mapped
+        data = self.codec.encode(val, allow_compression=False)
+        with open(os.path.join(self.tmp_path, _get_file_name(key)), 'wb') as f:
+            f.write(data)
+        return len(data)
+
+    def commit(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp_path, self.path)
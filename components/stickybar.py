@@ -25,7 +25,7 @@ class StickyBar:
     below_goal_good: bool = True
 
     def _calc_emissions(self):
-        df = predict_emissions()
+        df = predict_emissions().copy()
         forecast = df.pop('Forecast')
         self.emissions_df = df
 
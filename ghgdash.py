@@ -7,7 +7,9 @@ import dash_cytoscape as cyto
 from flask_session import Session
 
 from layout import initialize_app
-from common import cache
+from calc import admin, warmer
+from calc.utils import preload_datasets, start_dataset_refresher
+from common import cache, metrics, settings
 from common.locale import init_locale
 
 
@@ -26,6 +28,10 @@ with server.app_context():
     sess.init_app(server)
 
     init_locale(server)
+    metrics.init_app(server)
+
+    if settings.ADMIN_TOKEN:
+        admin.init_app(server)
 
 
 app = dash.Dash(__name__, server=server, suppress_callback_exceptions=True)
@@ -36,6 +42,13 @@ app.scripts.config.serve_locally = True
 cyto.load_extra_layouts()
 initialize_app(app)
 
+if settings.PRELOAD_DATASETS:
+    preload_datasets()
+if settings.DATASET_REFRESH_INTERVAL:
+    start_dataset_refresher(settings.DATASET_REFRESH_INTERVAL)
+if settings.WARMER_TOP_SCENARIOS:
+    warmer.init_app(server)
+
 if __name__ == '__main__':
     # Write the process pid to a file for easier profiling with py-spy
     with open('.ghgdash.pid', 'w') as pid_file:
@@ -0,0 +1,23 @@
+# Gunicorn reads this file from the working directory on startup.
+import os
+import shutil
+import tempfile
+
+# The Prometheus metrics of the workers are kept in files in this directory
+# and aggregated when /metrics is scraped (see common/metrics.py). It must
+# be set before prometheus_client is imported.
+METRICS_DIR = os.environ.setdefault(
+    'prometheus_multiproc_dir', os.path.join(tempfile.gettempdir(), 'ghgdash-metrics')
+)
+
+from prometheus_client import multiprocess  # noqa: E402
+
+
+def on_starting(server):
+    # Drop the metrics of the previous run
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    os.makedirs(METRICS_DIR)
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
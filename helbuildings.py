@@ -14,7 +14,7 @@ from calc import calcfunc
 from calc.electricity import calculate_electricity_supply_emission_factor
 from components.cards import GraphCard
 from components.graphs import make_layout
-from utils.quilt import load_datasets
+from utils.datasets import load_datasets
 
 
 app = dash.Dash(__name__, suppress_callback_exceptions=True)
@@ -191,7 +191,7 @@ class CarFleetPage(Page):
         """), lang='en')
 
         card = self.get_card('yearly-fleet-turnover')
-        df = predict_cars_in_use()
+        df = predict_cars_in_use().copy()
         fig = PredictionFigure(
             sector_name='Transportation',
             unit_name='%',
@@ -229,7 +229,7 @@ class CarFleetPage(Page):
         """))
 
         card = self.get_card('newly-registered-evs')
-        df = predict_newly_registered_cars()
+        df = predict_newly_registered_cars().copy()
         fc = df.pop('Forecast')
         total = df.sum(axis=1)
         df = df.div(total, axis=0)
@@ -278,7 +278,7 @@ class CarFleetPage(Page):
             )
         card.set_figure(fig)
 
-        df = predict_cars_emissions()
+        df = predict_cars_emissions().copy()
         with override_variable('share_of_ev_charging_station_demand_built', 0):
             with override_variable('parking_subsidy_for_evs', 0):
                 df0 = predict_cars_emissions()
@@ -112,7 +112,7 @@ class CarEmissionPage(Page):
         return grid.render()
 
     def refresh_graph_cards(self):
-        df = predict_cars_emissions()
+        df = predict_cars_emissions().copy()
         df['Mileage'] /= 1000000
 
         fig = self.draw_bev_chart(df)
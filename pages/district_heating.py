@@ -79,7 +79,7 @@ def generate_production_mix_graph(df):
 
 def generate_district_heating_forecast_table(df):
     last_hist_year = df[~df.Forecast].index.max()
-    df.index.name = 'Vuosi'
+    df = df.rename_axis('Vuosi')
 
     data_columns = list(df.columns)
     data_columns.remove('Forecast')
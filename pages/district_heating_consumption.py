@@ -200,7 +200,7 @@ def district_heating_consumption_callback(existing_building_perc, new_building_p
     set_variable('district_heating_existing_building_efficiency_change', existing_building_perc / 10)
     set_variable('district_heating_new_building_efficiency_change', new_building_perc / 10)
 
-    df = predict_district_heat_consumption()
+    df = predict_district_heat_consumption().copy()
     geo_df = predict_geothermal_production()
     geo_df = geo_df[geo_df.Forecast]
     df['GeoEnergyProductionExisting'] = geo_df['GeoEnergyProductionExisting']
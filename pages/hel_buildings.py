@@ -11,7 +11,7 @@ from calc import calcfunc
 from calc.electricity import calculate_electricity_supply_emission_factor
 from components.cards import GraphCard
 from components.graphs import make_layout
-from utils.quilt import load_datasets
+from utils.datasets import load_datasets
 from .base import Page
 
 DEFAULT_PRICE_PER_KWH = 12
@@ -153,7 +153,7 @@ class ModalSharePage(Page):
         self.set_variable('residential_parking_fee_share_of_cars_impacted', icard.get_slider_value())
 
         cd = CardDescription()
-        df = predict_parking_fee_impact()
+        df = predict_parking_fee_impact().copy()
 
         last_hist_year = df[~df.Forecast].index.max()
         fig = PredictionFigure(
@@ -198,7 +198,7 @@ class ModalSharePage(Page):
         """))
 
     def _refresh_trip_cards(self):
-        df = predict_passenger_kms()
+        df = predict_passenger_kms().copy()
 
         card = self.get_card('number-of-passenger-kms')
         fig = PredictionFigure(
@@ -255,7 +255,7 @@ class ModalSharePage(Page):
             color_scale=2,
             legend=True,
         )
-        mdf = predict_road_mileage()
+        mdf = predict_road_mileage().copy()
         pop = predict_population()
 
         cd = CardDescription()
@@ -307,7 +307,7 @@ class ModalSharePage(Page):
         with override_variable('residential_parking_fee_share_of_cars_impacted', 0):
             df0 = predict_cars_emissions()
 
-        df1 = predict_cars_emissions()
+        df1 = predict_cars_emissions().copy()
 
         df1['Emissions'] -= df0['Emissions']
         self.yearly_emissions_impact = df1['Emissions'].iloc[-1]
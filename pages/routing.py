@@ -2,6 +2,8 @@ import os
 import importlib
 import glob
 import inspect
+import sys
+from calc.utils import get_calcfuncs
 from .base import Page
 
 all_pages = {}
@@ -36,6 +38,24 @@ def load_pages():
             all_pages[page_class.path] = page_class
 
 
+# Modules whose calcfuncs are reachable from the pages
+PAGE_MODULE_PREFIXES = ('pages.', 'components.')
+
+
+def get_page_calcfuncs():
+    """Return the calcfuncs used directly by the pages and their components."""
+    if not all_pages:
+        load_pages()
+
+    calcfuncs = set(get_calcfuncs())
+    funcs = set()
+    for mod_name, mod in list(sys.modules.items()):
+        if not mod_name.startswith(PAGE_MODULE_PREFIXES) or mod is None:
+            continue
+        funcs.update(obj for obj in vars(mod).values() if callable(obj) and obj in calcfuncs)
+    return funcs
+
+
 def page_instance(page):
     if isinstance(page, Page):
         return page
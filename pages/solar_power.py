@@ -95,7 +95,7 @@ class PVPage(Page):
         future_card = self.get_card('new-buildings')
         set_variable('solar_power_new_buildings_percentage', future_card.get_slider_value())
 
-        df = predict_solar_power_production()
+        df = predict_solar_power_production().copy()
 
         forecast_df = df[df.Forecast]
         hist_df = df[~df.Forecast]
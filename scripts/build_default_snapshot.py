@@ -0,0 +1,16 @@
+"""Precompute the results of the default scenario for instant cold starts.
+
+Usage: python -m scripts.build_default_snapshot
+
+Every calcfunc used by the pages, and everything they depend on, is
+computed with the default variables. The results are written to
+DEFAULT_SNAPSHOT_DIR keyed by DEFAULT_VARIABLE_HASH. Run at build time from
+bin/post_compile.
+"""
+from calc.utils import build_default_snapshot
+from pages.routing import get_page_calcfuncs
+
+
+if __name__ == '__main__':
+    count = build_default_snapshot(get_page_calcfuncs())
+    print('Stored %d results in the default snapshot' % count)
@@ -0,0 +1,50 @@
+"""Import datasets from the quilt package store into the local Arrow store.
+
+Usage: python -m scripts.import_quilt_datasets [user/package/path ...]
+
+Without arguments, all the datasets used by calcfuncs and the pages are
+imported. Set DATASET_BACKEND=utils.local_datasets.LocalArrowBackend to use
+the imported datasets.
+"""
+import sys
+
+from calc.utils import get_dataset_specs
+from utils.datasets import normalize_dtypes
+from utils.local_datasets import LocalArrowBackend
+from utils.quilt import QuiltBackend
+
+
+# Datasets loaded outside calcfuncs
+EXTRA_DATASETS = [
+    'jyrjola/karttahel/buildings',
+    'jyrjola/hsy/buildings',
+    'jyrjola/fingrid_hourly/price',
+]
+
+
+def get_dataset_paths():
+    paths = set(EXTRA_DATASETS)
+    for spec in get_dataset_specs().values():
+        paths.add(spec if isinstance(spec, str) else spec['path'])
+    return sorted(paths)
+
+
+def import_datasets(paths):
+    quilt_backend = QuiltBackend()
+    local_backend = LocalArrowBackend()
+
+    for path in paths:
+        df = quilt_backend.load(path)
+        # Store the years already parsed, so that the mapped columns don't
+        # need to be copied when loading.
+        df = normalize_dtypes(df)
+        version = local_backend.write(path, df)
+        if version is None:
+            print('%s: unchanged' % path)
+            continue
+        local_backend.prune(path)
+        print('%s: imported version %s (%d rows)' % (path, version, len(df)))
+
+
+if __name__ == '__main__':
+    import_datasets(sys.argv[1:] or get_dataset_paths())
@@ -118,7 +118,7 @@ SECTOR_MAP = {
 
 
 def get_reduction_sectors():
-    df = predict_emission_reductions()
+    df = predict_emission_reductions().copy()
     df.columns = df.columns.to_flat_index()
     last_year = df.iloc[-1].sort_values(ascending=False)
     last_year = last_year[last_year > 0]
@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+
+def get_memory_usage(data):
+    if isinstance(data, pd.DataFrame):
+        return int(data.memory_usage(deep=True).sum())
+    if isinstance(data, (pd.Series, pd.Index)):
+        return int(data.memory_usage(deep=True))
+    return 0
+
+
+class DatasetCache:
+    """In-memory cache for loaded datasets with a byte budget.
+
+    When the total size of the datasets exceeds `max_bytes`, the least
+    recently used datasets are evicted. If `max_bytes` is not set, the
+    cache is unbounded.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.total_bytes = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            entry['hits'] += 1
+            return entry['data']
+
+    def _evict(self, keep):
+        if not self.max_bytes:
+            return
+
+        for key in list(self._entries.keys()):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            entry = self._entries.pop(key)
+            self.total_bytes -= entry['size']
+            self.evictions += 1
+
+    def set(self, key, data):
+        size = get_memory_usage(data)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old['size']
+            self._entries[key] = dict(data=data, size=size, hits=0, loaded_at=time.time())
+            self.total_bytes += size
+            self._evict(keep=key)
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.total_bytes -= entry['size']
+            return entry is not None
+
+    def get_or_load(self, key, loader):
+        """Return the dataset for `key`, calling `loader` to load it if needed.
+
+        Concurrent callers of the same key wait for a single load. The lock
+        of the load is dropped when it's done, so old dataset versions
+        don't leave locks behind.
+        """
+        data = self.get(key)
+        if data is not None:
+            return data
+
+        with self._lock:
+            load_lock = self._load_locks.get(key)
+            if load_lock is None:
+                load_lock = self._load_locks[key] = threading.Lock()
+
+        try:
+            with load_lock:
+                data = self.get(key)
+                if data is not None:
+                    return data
+                data = loader()
+                self.set(key, data)
+        finally:
+            with self._lock:
+                if self._load_locks.get(key) is load_lock:
+                    del self._load_locks[key]
+        return data
+
+    def get_stats(self):
+        with self._lock:
+            datasets = {
+                key: dict(size=entry['size'], hits=entry['hits'], loaded_at=entry['loaded_at'])
+                for key, entry in self._entries.items()
+            }
+            return dict(
+                total_bytes=self.total_bytes, max_bytes=self.max_bytes,
+                evictions=self.evictions, datasets=datasets,
+            )
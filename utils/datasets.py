@@ -0,0 +1,162 @@
+import importlib
+import operator
+import threading
+
+import pandas as pd
+
+from common import settings
+
+
+FILTER_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda s, val: s.isin(val),
+    'not in': lambda s, val: ~s.isin(val),
+}
+
+
+class DatasetNotFound(Exception):
+    pass
+
+
+def filter_dataframe(df, columns=None, filters=None):
+    """Select the rows matching all `filters` and only the given `columns`.
+
+    Filters are (column, operator, value) tuples.
+    """
+    if filters:
+        mask = None
+        for col, op, val in filters:
+            col_mask = FILTER_OPERATORS[op](df[col], val)
+            mask = col_mask if mask is None else mask & col_mask
+        df = df.loc[mask]
+    if columns:
+        df = df[list(columns)]
+    return df
+
+
+def get_read_columns(columns, filters, available_columns):
+    """Return the columns to read from storage for `columns` and `filters`.
+
+    Columns used only in filters must be read as well. Returns None if all
+    the columns are needed.
+    """
+    if not columns:
+        return None
+    read_columns = list(columns)
+    read_columns += [col for col, _, _ in filters or [] if col not in read_columns and col in available_columns]
+    return read_columns
+
+
+# Columns that hold years. They are parsed to integers if all the values
+# look like years.
+YEAR_COLUMNS = ('Vuosi', 'Year')
+
+# String columns with fewer unique values than this share of rows are
+# considered low-cardinality.
+CATEGORICAL_MAX_UNIQUE_RATIO = 0.5
+
+
+def _is_string_column(s):
+    return s.dtype == object and pd.api.types.infer_dtype(s, skipna=False) == 'string'
+
+
+def normalize_dtypes(df, categories=None):
+    """Convert the columns of a loaded dataset into more compact dtypes.
+
+    Year columns are parsed into integers. Columns listed in `categories`
+    are converted to the category dtype. If `categories` is True, all the
+    low-cardinality string columns are converted.
+
+    The columns are replaced in `df` one by one, so the other columns (e.g.
+    memory-mapped ones) are not copied.
+
+    Numeric columns are not downcast, because the calculations expect
+    64-bit values (e.g. converting GWh to kWh would overflow 32-bit ints).
+    """
+    converted = set()
+    for col in YEAR_COLUMNS:
+        if col not in df.columns or not _is_string_column(df[col]):
+            continue
+        s = df[col]
+        if s.str.match(r'^[0-9]{4}$').all():
+            df[col] = s.astype(int)
+            converted.add(col)
+
+    if categories is True:
+        categories = [
+            col for col in df.columns if col not in converted and _is_string_column(df[col]) and
+            df[col].nunique() < len(df) * CATEGORICAL_MAX_UNIQUE_RATIO
+        ]
+    for col in categories or []:
+        df[col] = df[col].astype('category')
+
+    return df
+
+
+class DatasetBackend:
+    """Storage for the datasets, addressed by `user/package/path`."""
+
+    def load(self, package_path, columns=None, filters=None, version=None):
+        """Return the dataset as a DataFrame.
+
+        Only the rows matching `filters` and the given `columns` are
+        returned. If `version` is given, that version of the dataset is
+        loaded. Raises DatasetNotFound if the dataset doesn't exist.
+        """
+        raise NotImplementedError()
+
+    def get_version(self, package_path):
+        """Return an identifier for the current contents of the dataset.
+
+        The identifier changes whenever the contents change. Returns None if
+        the version can't be determined.
+        """
+        return None
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Return the dataset backend configured in settings.DATASET_BACKEND."""
+    global _backend
+
+    with _backend_lock:
+        if _backend is None:
+            module_path, class_name = settings.DATASET_BACKEND.rsplit('.', 1)
+            backend_class = getattr(importlib.import_module(module_path), class_name)
+            _backend = backend_class()
+    return _backend
+
+
+def load_datasets(packages, include_units=False, columns=None, filters=None, categories=None, version=None):
+    """Load datasets from the configured dataset backend.
+
+    If `columns` or `filters` are given, they are applied to every dataset
+    and pushed down to the storage where possible. If `version` is given,
+    that version is loaded (see DatasetBackend.get_version()). The dtypes of
+    the datasets are normalized with normalize_dtypes().
+    """
+    if not isinstance(packages, (list, tuple)):
+        packages = [packages]
+
+    for _, op, _ in filters or []:
+        assert op in FILTER_OPERATORS, 'Unsupported filter operator: %s' % op
+
+    backend = get_backend()
+    datasets = []
+    for package_path in packages:
+        df = backend.load(package_path, columns=columns, filters=filters, version=version)
+        df = normalize_dtypes(df, categories)
+        datasets.append(df)
+
+    if len(datasets) == 1:
+        return datasets[0]
+
+    return datasets
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import tempfile
+import time
+
+import pyarrow as pa
+from pyarrow import feather
+
+from common import settings
+from .datasets import DatasetBackend, DatasetNotFound, filter_dataframe, get_read_columns
+
+
+FILE_SUFFIX = '.feather'
+
+
+def _hash_file(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class LocalArrowBackend(DatasetBackend):
+    """Datasets stored as versioned Arrow (Feather v2) files.
+
+    Each dataset `user/package/path` is a directory under `root` with one
+    file per version, and the newest version is used. The files are
+    uncompressed and memory-mapped, so all the processes on the node share
+    the same pages. Numeric columns of unfiltered datasets are not copied
+    at all, which also makes them read-only.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or settings.DATASET_DIR
+
+    def _get_dir(self, package_path):
+        parts = package_path.split('/')
+        if not all(parts) or '..' in parts:
+            raise ValueError('Invalid dataset path: %s' % package_path)
+        return os.path.join(self.root, *parts)
+
+    def list_versions(self, package_path):
+        try:
+            names = os.listdir(self._get_dir(package_path))
+        except FileNotFoundError:
+            return []
+        # Versions start with a timestamp, so they sort chronologically
+        return sorted(
+            name[:-len(FILE_SUFFIX)] for name in names
+            if name.endswith(FILE_SUFFIX) and not name.startswith('.')
+        )
+
+    def get_latest_version(self, package_path):
+        versions = self.list_versions(package_path)
+        return versions[-1] if versions else None
+
+    def get_version(self, package_path):
+        return self.get_latest_version(package_path)
+
+    def get_path(self, package_path, version=None):
+        if version is None:
+            version = self.get_latest_version(package_path)
+            if version is None:
+                raise DatasetNotFound('Dataset %s not found' % package_path)
+        return os.path.join(self._get_dir(package_path), version + FILE_SUFFIX)
+
+    def load(self, package_path, columns=None, filters=None, version=None):
+        path = self.get_path(package_path, version)
+        try:
+            with pa.memory_map(path, 'r') as source:
+                schema = pa.ipc.open_file(source).schema
+        except FileNotFoundError:
+            raise DatasetNotFound('Dataset %s version %s not found' % (package_path, version))
+
+        read_columns = get_read_columns(columns, filters, schema.names)
+        table = feather.read_table(path, columns=read_columns, memory_map=True)
+        # With split_blocks, numeric columns without nulls point directly
+        # to the mapped file.
+        df = table.to_pandas(split_blocks=True)
+        if columns or filters:
+            df = filter_dataframe(df, columns, filters)
+        return df
+
+    def write(self, package_path, df):
+        """Store `df` as a new version of the dataset.
+
+        Returns the version, or None if the data is identical to the latest
+        version.
+        """
+        dir_path = self._get_dir(package_path)
+        os.makedirs(dir_path, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix='.tmp-')
+        os.close(fd)
+        try:
+            # Compressed files can't be memory-mapped without copying
+            feather.write_feather(df, tmp_path, compression='uncompressed', version=2)
+            digest = _hash_file(tmp_path)
+
+            latest = self.get_latest_version(package_path)
+            if latest is not None and latest.rsplit('-', 1)[-1] == digest[:12]:
+                os.unlink(tmp_path)
+                return None
+
+            version = '%s-%s' % (time.strftime('%Y%m%dT%H%M%S', time.gmtime()), digest[:12])
+            os.replace(tmp_path, self.get_path(package_path, version))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        return version
+
+    def prune(self, package_path, keep=2):
+        """Remove all but the `keep` newest versions of the dataset.
+
+        Processes that have an old version mapped can keep using it.
+        """
+        versions = self.list_versions(package_path)
+        for version in versions[:-keep]:
+            try:
+                os.unlink(self.get_path(package_path, version))
+            except FileNotFoundError:
+                pass
@@ -1,3 +1,4 @@
+import hashlib
 import threading
 import logging
 
@@ -7,9 +8,22 @@ from quilt.tools import store
 from quilt.tools.command import _materialize
 from quilt.imports import _from_core_node
 
+from .datasets import DatasetBackend, DatasetNotFound, filter_dataframe, get_read_columns
+
 logger = logging.getLogger(__name__)
 
-quilt_lock = threading.Lock()
+# Locks are per package, so that different packages can be loaded concurrently
+_package_locks = {}
+_package_locks_lock = threading.Lock()
+
+
+def _get_package_lock(package_path):
+    user, root_pkg, *sub_paths = package_path.split('/')
+    with _package_locks_lock:
+        lock = _package_locks.get((user, root_pkg))
+        if lock is None:
+            lock = _package_locks[(user, root_pkg)] = threading.Lock()
+    return lock
 
 
 def _load_from_quilt(package_path):
@@ -33,33 +47,70 @@ def _load_from_quilt(package_path):
                 node = _from_core_node(pkg_store, child_node)
             break
         else:
-            raise Exception('Dataset %s not found' % package_path)
+            raise DatasetNotFound('Dataset %s not found' % package_path)
     return node
 
 
-def load_datasets(packages, include_units=False):
-    if not isinstance(packages, (list, tuple)):
-        packages = [packages]
+def _find_core_node(package_path):
+    user, root_pkg, *sub_paths = package_path.split('/')
+
+    pkg_store, node = store.PackageStore.find_package(None, user, root_pkg)
+    if node is None:
+        quilt.install(package_path, force=True)
+        pkg_store, node = store.PackageStore.find_package(None, user, root_pkg)
+
+    for name in sub_paths:
+        node = node.children.get(name)
+        if node is None:
+            raise DatasetNotFound('Dataset %s not found' % package_path)
+    return node
+
 
-    datasets = []
-    for package_path in packages:
-        with quilt_lock:
+def _read_parquet(pf, columns, filters):
+    filters = [tuple(x) for x in filters or []]
+    read_columns = get_read_columns(columns, filters, pf.columns)
+
+    # fastparquet only skips the row groups that can't match based on
+    # their statistics, so the rows still need to be filtered.
+    df = pf.to_pandas(columns=read_columns, filters=filters)
+    return filter_dataframe(df, columns, filters)
+
+
+class QuiltBackend(DatasetBackend):
+    """Datasets from the legacy quilt package store.
+
+    Missing packages are installed on first use.
+    """
+
+    def get_version(self, package_path):
+        # The object hashes of the node change with the contents
+        with _get_package_lock(package_path):
+            node = _find_core_node(package_path)
+        hashes = getattr(node, 'hashes', None)
+        if not hashes:
+            return None
+        return hashlib.sha1(''.join(hashes).encode('ascii')).hexdigest()[:12]
+
+    def load(self, package_path, columns=None, filters=None, version=None):
+        if version is not None and version != self.get_version(package_path):
+            # The store holds only one version of each package
+            raise DatasetNotFound('Dataset %s version %s not found' % (package_path, version))
+
+        package_lock = _get_package_lock(package_path)
+        with package_lock:
             node = _load_from_quilt(package_path)
 
         try:
             df = node()
         except store.StoreException:
-            with quilt_lock:
+            with package_lock:
                 _materialize(node)
             df = node()
 
         if isinstance(df, str):
             pf = fastparquet.ParquetFile(df)
-            df = pf.to_pandas()
-
-        datasets.append(df)
-
-    if len(datasets) == 1:
-        return datasets[0]
+            df = _read_parquet(pf, columns, filters)
+        elif columns or filters:
+            df = filter_dataframe(df, columns, filters)
 
-    return datasets
+        return df
@@ -1,7 +1,7 @@
 import json
 import flask
 import hashlib
-import threading
+import contextvars
 from flask import session
 from contextlib import contextmanager
 
@@ -120,7 +120,101 @@ VARIABLE_DEFAULTS = {
 }
 
 
-_variable_overrides = threading.local()
+def _hash_value(val):
+    return hashlib.md5(json.dumps(val, sort_keys=True).encode('utf8')).hexdigest()
+
+
+_default_value_hashes = {var_name: _hash_value(val) for var_name, val in VARIABLE_DEFAULTS.items()}
+
+
+class Scenario:
+    """Immutable set of variable values overriding the defaults.
+
+    Scenarios are hashable and the hash is computed only once, so it can be
+    reused for the whole request. The hashes of the individual variable
+    values and their combinations are precomputed on first use as well.
+    None values are treated as unset.
+    """
+
+    def __init__(self, values=None):
+        self._values = {
+            var_name: list(val) if isinstance(val, list) else val
+            for var_name, val in (values or {}).items() if val is not None
+        }
+        self._hash = None
+        self._value_hashes = {
+            var_name: _hash_value(val) for var_name, val in self._values.items()
+        }
+        self._combined_hashes = {}
+
+    def get(self, var_name, default=None):
+        return self._values.get(var_name, default)
+
+    def __contains__(self, var_name):
+        return var_name in self._values
+
+    def items(self):
+        return self._values.items()
+
+    def replace(self, values):
+        """Return a new scenario with `values` added."""
+        new_values = dict(self._values)
+        new_values.update(values)
+        return Scenario(new_values)
+
+    def without(self, var_name):
+        """Return a new scenario without the value for `var_name`."""
+        return Scenario({key: val for key, val in self._values.items() if key != var_name})
+
+    def get_value_hash(self, var_name):
+        """Return the hash of the value of `var_name`, falling back to the default."""
+        val_hash = self._value_hashes.get(var_name)
+        if val_hash is None:
+            val_hash = _default_value_hashes[var_name]
+        return val_hash
+
+    def get_values_hash(self, var_names):
+        """Return a combined hash of the values of the variables in `var_names`.
+
+        `var_names` must be a sorted tuple.
+        """
+        combined = self._combined_hashes.get(var_names)
+        if combined is None:
+            m = hashlib.md5()
+            for var_name in var_names:
+                m.update(('%s=%s;' % (var_name, self.get_value_hash(var_name))).encode('utf8'))
+            combined = self._combined_hashes[var_names] = m.hexdigest()
+        return combined
+
+    def is_default(self, var_names):
+        """Return True if all the variables in `var_names` have their default values."""
+        for var_name in var_names:
+            if self.get_value_hash(var_name) != _default_value_hashes[var_name]:
+                return False
+        return True
+
+    @property
+    def hash(self):
+        if self._hash is None:
+            data = json.dumps(self._values, sort_keys=True)
+            self._hash = hashlib.md5(data.encode('utf8')).hexdigest()
+        return self._hash
+
+    def __hash__(self):
+        return hash(self.hash)
+
+    def __eq__(self, other):
+        return isinstance(other, Scenario) and self.hash == other.hash
+
+    def __repr__(self):
+        return 'Scenario(%r)' % self._values
+
+
+EMPTY_SCENARIO = Scenario()
+
+# Scenario set with override_variable() or use_scenario(). It's propagated
+# to asyncio tasks automatically and to threads with contextvars.copy_context().
+_scenario_var = contextvars.ContextVar('scenario', default=None)
 
 # Make a hash of the default variables so that when they change,
 # we will reset everybody's custom session variables.
@@ -134,15 +228,59 @@ def _validate_variable_value(var_name, value):
     assert isinstance(value, type(VARIABLE_DEFAULTS[var_name]))
 
 
+def _get_session_scenario():
+    # The scenario is built from the session once per request
+    scenario = getattr(flask.g, '_scenario', None)
+    if scenario is None:
+        if session.get('_default_variable_hash', '') != DEFAULT_VARIABLE_HASH:
+            reset_variables()
+        scenario = Scenario({x: session[x] for x in VARIABLE_DEFAULTS.keys() if x in session})
+        flask.g._scenario = scenario
+    return scenario
+
+
+def _invalidate_session_scenario():
+    flask.g.pop('_scenario', None)
+
+
+def get_scenario():
+    """Return the scenario of the current context.
+
+    The scenario set with override_variable() or use_scenario() takes
+    precedence over the one stored in the session.
+    """
+    scenario = _scenario_var.get()
+    if scenario is not None:
+        return scenario
+    if flask.has_request_context():
+        return _get_session_scenario()
+    return EMPTY_SCENARIO
+
+
+@contextmanager
+def use_scenario(scenario):
+    """Evaluate the variables in `scenario`, e.g. in a worker thread."""
+    token = _scenario_var.set(scenario)
+    try:
+        yield None
+    finally:
+        _scenario_var.reset(token)
+
+
 def set_variable(var_name, value):
     _validate_variable_value(var_name, value)
 
     if not flask.has_request_context():
         if not _allow_variable_set:
             raise Exception('Should not set variable outside of request context')
-        setattr(_variable_overrides, var_name, value)
+        _scenario_var.set(get_scenario().replace({var_name: value}))
         return
 
+    _invalidate_session_scenario()
+    if _scenario_var.get() is not None:
+        # Keep an overridden scenario in sync until the override ends
+        _scenario_var.set(_scenario_var.get().replace({var_name: value}))
+
     if value == VARIABLE_DEFAULTS[var_name]:
         if var_name in session:
             del session[var_name]
@@ -152,17 +290,10 @@ def set_variable(var_name, value):
 
 
 def get_variable(var_name, var_store=None):
-    out = None
-
     if var_store is not None:
         out = var_store.get(var_name)
-    elif hasattr(_variable_overrides, var_name):
-        out = getattr(_variable_overrides, var_name)
-    elif flask.has_request_context():
-        if session.get('_default_variable_hash', '') != DEFAULT_VARIABLE_HASH:
-            reset_variables()
-        if var_name in session:
-            out = session[var_name]
+    else:
+        out = get_scenario().get(var_name)
 
     if out is None:
         out = VARIABLE_DEFAULTS[var_name]
@@ -176,15 +307,16 @@ def get_variable(var_name, var_store=None):
 
 def reset_variable(var_name):
     if flask.has_request_context():
+        _invalidate_session_scenario()
         if var_name in session:
             del session[var_name]
     else:
-        if hasattr(_variable_overrides, var_name):
-            delattr(_variable_overrides, var_name)
+        _scenario_var.set(get_scenario().without(var_name))
 
 
 def reset_variables():
     if flask.has_request_context():
+        _invalidate_session_scenario()
         session['_default_variable_hash'] = DEFAULT_VARIABLE_HASH
         for var_name in VARIABLE_DEFAULTS.keys():
             if var_name not in session:
@@ -201,6 +333,14 @@ def copy_variables():
     return out
 
 
+def get_changed_variables():
+    """Return the variables that differ from their default values."""
+    return {
+        var_name: val for var_name, val in copy_variables().items()
+        if val != VARIABLE_DEFAULTS[var_name]
+    }
+
+
 @contextmanager
 def allow_set_variable():
     global _allow_variable_set
@@ -213,21 +353,16 @@ def allow_set_variable():
         _allow_variable_set = old
 
 
-class Undefined:
-    pass
-
-
 @contextmanager
 def override_variable(var_name, val):
-    _validate_variable_value(var_name, val)
+    with override_variables({var_name: val}):
+        yield None
 
-    old_val = getattr(_variable_overrides, var_name, Undefined)
 
-    setattr(_variable_overrides, var_name, val)
-    try:
+@contextmanager
+def override_variables(values):
+    for var_name, val in values.items():
+        _validate_variable_value(var_name, val)
+
+    with use_scenario(get_scenario().replace(values)):
         yield None
-    finally:
-        if old_val == Undefined:
-            delattr(_variable_overrides, var_name)
-        else:
-            setattr(_variable_overrides, var_name, old_val)